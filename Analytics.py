@@ -0,0 +1,165 @@
+# --- Parallel streaming aggregation of search results: word frequencies, top authors and distinct counts --- #
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from heapq import nlargest
+import math
+import os
+import re
+
+
+CHUNK_SIZE = 5000           # records sent to a worker process at a time
+TOP_K = 100                 # number of heavy hitters reported by default
+TOPK_CAPACITY = 10000       # counters kept by a TopK summary (more counters give more accurate counts for the top items)
+HLL_PRECISION = 14          # HyperLogLog uses 2**precision one-byte registers; the standard error is about 1.04 / sqrt(2**precision)
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+# Split a text into lowercase words
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+# HyperLogLog sketch estimating the number of distinct values added to it, in 2**precision bytes
+# Sketches built on different processes, days or subreddits are combined with merge (values are hashed with blake2b, not hash())
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(2**precision)
+
+    def add(self, value):
+        h = int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        bits = 64 - self.precision
+        j, w = h >> bits, h & ((1 << bits) - 1)
+        rank = bits - w.bit_length() + 1
+        if rank > self.registers[j]: self.registers[j] = rank
+
+    def update(self, values):
+        for value in set(values):
+            self.add(value)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f'cannot merge HyperLogLog sketches of precision {self.precision} and {other.precision}')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    # Estimated number of distinct values (with the small-range correction of Flajolet et al.)
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+# Mergeable heavy-hitters summary (Misra-Gries / space-saving style) holding at most `capacity` counters
+# Counts are exact until the summary overflows; then the smallest counters are dropped and `error` bounds how much any reported
+# count may fall short of the true count (items never counted may be missing from the top k by at most that much)
+class TopK:
+    def __init__(self, capacity=TOPK_CAPACITY):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.error = 0
+
+    def update(self, values):
+        self.counts.update(values)
+        self.trim()
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.error += other.error
+        self.trim()
+        return self
+
+    def trim(self):
+        if len(self.counts) <= self.capacity: return
+        kept = nlargest(self.capacity + 1, self.counts.items(), key=lambda item: item[1])
+        self.error += kept[-1][1]    # no dropped item had a larger count than the largest dropped counter
+        self.counts = Counter(dict(kept[:-1]))
+
+    # Return the k most common (item, count) pairs
+    def top(self, k=TOP_K):
+        return self.counts.most_common(k)
+
+
+# Mergeable aggregate of a stream of records: number of records, word and author heavy hitters, and distinct word and author sketches
+class Summary:
+    def __init__(self, capacity=TOPK_CAPACITY, precision=HLL_PRECISION):
+        self.records = 0
+        self.words, self.authors = TopK(capacity), TopK(capacity)
+        self.distinct_words, self.distinct_authors = HyperLogLog(precision), HyperLogLog(precision)
+
+    # Add a chunk of records, given as their texts and authors (either may be empty)
+    def update(self, num_records, texts, authors):
+        words = Counter()
+        for text in texts:
+            words.update(tokenize(text))
+        self.records += num_records
+        self.words.update(words)
+        self.distinct_words.update(words)
+        self.authors.update(authors)
+        self.distinct_authors.update(authors)
+
+    def merge(self, other):
+        self.records += other.records
+        self.words.merge(other.words)
+        self.authors.merge(other.authors)
+        self.distinct_words.merge(other.distinct_words)
+        self.distinct_authors.merge(other.distinct_authors)
+        return self
+
+    # Return a json-serializable report
+    def report(self, k=TOP_K):
+        return {
+            'records': self.records, 'distinct_words': self.distinct_words.count(), 'distinct_authors': self.distinct_authors.count(),
+            'top_words': self.words.top(k), 'top_authors': self.authors.top(k), 'max_count_error': max(self.words.error, self.authors.error)
+        }
+
+
+# Summarize one chunk; runs in a worker process
+def summarize_chunk(num_records, texts, authors, capacity, precision):
+    summary = Summary(capacity=capacity, precision=precision)
+    summary.update(num_records, texts, authors)
+    return summary
+
+
+# Aggregate a stream of records (e.g. iter_comments(..., fields=['author', 'body'])) into a Summary using a pool of worker processes
+# Records are read lazily and only text_field / author_field are sent to the workers, in chunks of chunk_size records; at most two
+# chunks per process are in flight, so memory stays bounded by the summaries however long the stream is
+#   text_field / author_field: record fields holding the text to tokenize and the author (None to skip)
+#   processes: number of worker processes (default: one per core); 0 summarizes in the calling process
+# Summaries of different days or subreddits can be combined with Summary.merge
+def analyze(records, text_field='body', author_field='author', processes=None, chunk_size=CHUNK_SIZE, capacity=TOPK_CAPACITY, precision=HLL_PRECISION):
+    summary = Summary(capacity=capacity, precision=precision)
+    chunks = iter_chunks(records, text_field, author_field, chunk_size)
+    if processes == 0:
+        for num_records, texts, authors in chunks:
+            summary.update(num_records, texts, authors)
+        return summary
+
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for num_records, texts, authors in chunks:
+            pending.append(executor.submit(summarize_chunk, num_records, texts, authors, capacity, precision))
+            if len(pending) >= 2 * processes:
+                summary.merge(pending.popleft().result())
+        while pending:
+            summary.merge(pending.popleft().result())
+    return summary
+
+
+# Group a stream of records into (number of records, texts, authors) chunks of chunk_size records
+def iter_chunks(records, text_field, author_field, chunk_size):
+    num_records, texts, authors = 0, [], []
+    for record in records:
+        num_records += 1
+        if text_field is not None and record.get(text_field): texts.append(record[text_field])
+        if author_field is not None and record.get(author_field): authors.append(record[author_field])
+        if num_records >= chunk_size:
+            yield num_records, texts, authors
+            num_records, texts, authors = 0, [], []
+    if num_records:
+        yield num_records, texts, authors
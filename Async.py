@@ -0,0 +1,419 @@
+# --- Native asyncio counterparts of the search, count and sample functions --- #
+from datetime import datetime
+from time import monotonic
+import asyncio
+import random
+
+try:
+    import aiohttp
+except ImportError:     # optional dependency; only needed by AsyncClient
+    aiohttp = None
+
+from RedditAPIWrapper.Cache import get_cache
+from RedditAPIWrapper.Columnar import ColumnarResults
+from RedditAPIWrapper.Decode import decode, prune, get_decode_pool, DECODE_POOL_MIN_BYTES
+from RedditAPIWrapper.Metrics import emit, phase, collect, Stats
+from RedditAPIWrapper.Main import NUM_RESULTS_PER_CALL, NUM_RESULTS_LIMIT, count_kwargs, parse_count, histogram_kwargs, parse_histogram, split_dense_runs, choose_frequency, histogram_spans, pack_windows, time_range_to_interval, FREQUENCIES
+from RedditAPIWrapper.RateLimit import rate_limiter
+from RedditAPIWrapper.Sampling import plan_strata, hour_spans, plan_slices, thin
+from RedditAPIWrapper.Transport import API_HOST, CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS, FakeResponse
+from RedditAPIWrapper.Utilities import build_url_params, build_url, pack_chunks, merge_data, request_kind, retry_delay, ATTEMPT_LIMIT, MAX_URL_LENGTH
+
+
+MAX_IN_FLIGHT = 16      # default bound on concurrent requests per client / windows per search
+
+
+# Shared aiohttp client with a bounded number of requests in flight
+#   host: redirect requests for API_HOST to another server (e.g. a local stub such as 'http://localhost:8000')
+class AsyncClient:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, connect_timeout=CONNECT_TIMEOUT_SECONDS, read_timeout=READ_TIMEOUT_SECONDS, host=None):
+        if aiohttp is None:
+            raise ImportError('the async API requires aiohttp (pip install aiohttp)')
+        self.max_in_flight = max_in_flight
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.host = host
+        self.session, self.semaphore, self.loop = None, None, None
+
+    # aiohttp sessions belong to an event loop; open a new one whenever the client is used from a different loop
+    async def ensure_session(self):
+        loop = asyncio.get_running_loop()
+        if self.session is not None and self.loop is not loop:
+            await self.close_stale_session()
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers={'Accept-Encoding': 'gzip, deflate'})
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.loop = loop
+
+    # Close the session opened on a previous event loop, on that loop: through it if it is running (in another thread), otherwise by
+    # running it in a worker thread until the session is closed. A closed loop cannot run anything; its session is dropped
+    async def close_stale_session(self):
+        session, loop = self.session, self.loop
+        self.session, self.semaphore, self.loop = None, None, None
+        if loop.is_closed(): return
+        if loop.is_running():
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+        else:
+            await asyncio.to_thread(loop.run_until_complete, session.close())
+
+    async def get(self, url):
+        await self.ensure_session()
+        if self.host and url.startswith(API_HOST):
+            url = self.host + url[len(API_HOST):]
+        async with self.semaphore:
+            start = monotonic()
+            async with self.session.get(url) as response:
+                body = await response.read()
+                return FakeResponse(response.status, body, headers=dict(response.headers), elapsed=monotonic() - start)
+
+    async def close(self):
+        if self.session is None: return
+        if self.loop is not asyncio.get_running_loop():
+            return await self.close_stale_session()
+        await self.session.close()
+        self.session = None
+
+
+# Async client serving responses from a (synchronous) FakeTransport, for testing without network access or aiohttp
+class AsyncFakeClient:
+    def __init__(self, transport, max_in_flight=MAX_IN_FLIGHT):
+        self.transport = transport
+        self.max_in_flight = max_in_flight
+        self.semaphore, self.loop = None, None
+
+    async def get(self, url):
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None or self.loop is not loop:
+            self.semaphore, self.loop = asyncio.Semaphore(self.max_in_flight), loop
+        async with self.semaphore:
+            await asyncio.sleep(0)
+            return self.transport.get(url)
+
+    async def close(self):
+        pass
+
+
+client = None
+
+
+# Return the client used by async_fetch_data (created on first use)
+def get_async_client():
+    global client
+    if client is None:
+        client = AsyncClient()
+    return client
+
+
+# Replace the client used by async_fetch_data (e.g. with an AsyncClient of a different size, or an AsyncFakeClient)
+def set_async_client(new_client):
+    global client
+    client = new_client
+
+
+# Async counterpart of fetch_data; shares its url building, cache and process-wide rate limiter
+# The chunks of an over-long request are fetched concurrently; cache lookups and decoding run off the event loop
+async def async_fetch_data(url, kwargs={}, printing=True, attempt=0):
+    if attempt > ATTEMPT_LIMIT:
+        print('\nAttempt limit exceeded.')
+        return None
+
+    params = build_url_params(**kwargs)
+    combined_url = build_url(url, params)
+
+    if len(combined_url) > MAX_URL_LENGTH:
+        chunks = pack_chunks(url, kwargs)
+        if len(chunks) > 1:
+            if printing: print(f'URL too long; packed list params into {len(chunks)} requests ...')
+            results = await asyncio.gather(*(async_fetch_data(url, kwargs=chunk, printing=printing) for chunk in chunks))
+            if any(res is None for res in results): return None
+            return [contents for res in results for contents in res]
+
+    loop = asyncio.get_running_loop()
+    cache = get_cache()
+    if cache is not None:
+        contents = await loop.run_in_executor(None, cache.get, url, params)
+        if contents is not None:
+            if printing: print(f'\nServed \'{combined_url}\' from cache.')
+            emit('request', url=combined_url, cached=True)
+            return [prune(contents, kwargs.get('fields'))]
+
+    if printing: print(f'\nFetching data from \'{combined_url}\' ...')
+
+    delay = rate_limiter.reserve()
+    if delay > 0:
+        emit('rate_wait', seconds=delay)
+        await asyncio.sleep(delay)
+    try:
+        response = await get_async_client().get(combined_url)
+    except Exception as e:
+        print(f'Request failed critically; Error: {e}')
+        emit('error', url=combined_url, error=str(e))
+        return None
+
+    if printing: print(f'Done. Status code: {response.status_code} ({response.reason}). Elapsed time: {round(response.elapsed.total_seconds(), 2)} seconds.')
+    emit('request', url=combined_url, status=response.status_code, latency=response.elapsed.total_seconds(), bytes=len(response.content), attempt=attempt)
+
+    if response.ok:
+        rate_limiter.on_success(response.elapsed.total_seconds(), kind=request_kind(params))
+        contents = await async_decode_response(response.content, kwargs.get('fields'))
+        if cache is not None: await loop.run_in_executor(None, cache.put, url, params, response.content)
+        return [contents]
+    else:
+        if response.status_code == 429:
+            sleep_duration = retry_delay(response.headers, attempt)
+            if printing: print(f'Request failed; waiting {sleep_duration} seconds before trying again...')
+            rate_limiter.on_throttle(sleep_duration)
+            emit('throttle', seconds=sleep_duration, attempt=attempt)
+            return await async_fetch_data(url, kwargs=kwargs, printing=printing, attempt=attempt+1)
+        else:
+            print('Request failed critically.')
+            emit('error', url=combined_url, error=f'status code {response.status_code}')
+            return None
+
+
+# Async counterpart of Decode.decode_response; decodes in the decode pool or the loop's default executor, not on the event loop
+async def async_decode_response(content, fields=None):
+    pool = get_decode_pool()
+    if pool is not None and len(content) >= DECODE_POOL_MIN_BYTES:
+        return await asyncio.wrap_future(pool.submit(decode, content, fields))
+    return await asyncio.get_running_loop().run_in_executor(None, decode, content, fields)
+
+
+# Async counterpart of search_submissions_base
+async def async_search_submissions_base(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'count': count, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    results = await async_fetch_data(base_url, kwargs=kwargs, printing=printing)
+    if len(results) == 1: return results[0]['data']     # the decoded page is handed over as is
+    return merge_data(results, sort_attribute=sort_attribute, sort_rev=sort_rev, count=count, fields=fields)
+
+
+# Async counterpart of search_comments_base
+async def async_search_comments_base(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+    kwargs = {'query': query, 'ids': ids, 'count': count, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range}
+    results = await async_fetch_data(base_url, kwargs=kwargs, printing=printing)
+    if len(results) == 1: return results[0]['data']     # the decoded page is handed over as is
+    return merge_data(results, sort_attribute=sort_attribute, sort_rev=sort_rev, count=count, fields=fields)
+
+
+# Async counterpart of search_submissions; up to `concurrency` windows are fetched at once
+# use columnar=True to get a ColumnarResults (see Columnar.py) instead of a list of dictionaries
+# pass a Stats object (see Metrics.py) as stats to collect the search's request metrics; a report is printed if printing
+async def async_search_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, concurrency=MAX_IN_FLIGHT, stats=None, columnar=False):
+    results = ColumnarResults() if columnar else []
+    pages = async_iter_submissions(
+        query=query, title_query=title_query, selftext_query=selftext_query, ids=ids, count=count, fields=fields, sort_attribute=sort_attribute, sort_rev=sort_rev, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, num_comments_range=num_comments_range, printing=printing, concurrency=concurrency, pages=True
+    )
+    if stats is None: stats = Stats()
+    with collect(stats):
+        async for page in pages:
+            results.extend(page)
+    if printing: print(f'\n{stats.report()}')
+    return results
+
+
+# Async counterpart of search_comments; up to `concurrency` windows are fetched at once
+# use columnar=True to get a ColumnarResults (see Columnar.py) instead of a list of dictionaries
+# pass a Stats object (see Metrics.py) as stats to collect the search's request metrics; a report is printed if printing
+async def async_search_comments(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, concurrency=MAX_IN_FLIGHT, stats=None, columnar=False):
+    results = ColumnarResults() if columnar else []
+    pages = async_iter_comments(
+        query=query, ids=ids, count=count, fields=fields, sort_attribute=sort_attribute, sort_rev=sort_rev, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, printing=printing, concurrency=concurrency, pages=True
+    )
+    if stats is None: stats = Stats()
+    with collect(stats):
+        async for page in pages:
+            results.extend(page)
+    if printing: print(f'\n{stats.report()}')
+    return results
+
+
+# Async generator counterpart of iter_submissions
+async def async_iter_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, concurrency=MAX_IN_FLIGHT, pages=False):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range, 'printing': printing}
+    async for page in async_iter_search(base_url, async_search_submissions_base, kwargs, count, time_range, concurrency):
+        if pages: yield page
+        else:
+            for item in page: yield item
+
+
+# Async generator counterpart of iter_comments
+async def async_iter_comments(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, concurrency=MAX_IN_FLIGHT, pages=False):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'printing': printing}
+    async for page in async_iter_search(base_url, async_search_comments_base, kwargs, count, time_range, concurrency):
+        if pages: yield page
+        else:
+            for item in page: yield item
+
+
+# Shared body of async_iter_submissions / async_iter_comments; yields pages
+async def async_iter_search(base_url, search_base, kwargs, count, time_range, concurrency):
+    if count is None: count = NUM_RESULTS_LIMIT
+    else: count = min(count, NUM_RESULTS_LIMIT)
+
+    time_range = list(time_range)
+    if time_range[0] is None: time_range[0] = datetime(2005, 12, 1)     # approximate start date of data set
+    if time_range[1] is None: time_range[1] = datetime.today()
+
+    if count <= NUM_RESULTS_PER_CALL:
+        page = await search_base(**kwargs, count=count, time_range=time_range)
+        emit('page', records=len(page))
+        yield page
+        return
+
+    predicate = {k: v for k, v in kwargs.items() if k not in ('fields', 'sort_attribute', 'sort_rev', 'printing')}
+    windows = await async_plan_windows(base_url, predicate, time_range, printing=kwargs['printing'])
+    if kwargs['printing'] and windows: print(f'\nResults found: {sum(n for _, n in windows)}. Planned {len(windows)} windows.')
+    if kwargs['sort_rev'] and kwargs['sort_attribute'] in (None, 'created_utc'):
+        windows = windows[::-1]     # newest window first when results are requested in descending time order
+    async for page in async_fetch_windows(search_base, kwargs, windows, count, concurrency=concurrency):
+        emit('page', records=len(page))
+        yield page
+
+
+# Async counterpart of fetch_windows; keeps at most `concurrency` windows in flight and yields their pages in window order
+async def async_fetch_windows(search_base, kwargs, windows, count, concurrency=MAX_IN_FLIGHT):
+    windows = iter(windows)
+    pending = []
+    received, planned = 0, 0    # planned counts results expected from windows already submitted
+    try:
+        while True:
+            while len(pending) < concurrency and planned < count:
+                window = next(windows, None)
+                if window is None: break
+                window_range, num_results = window
+                size = min(count - planned, num_results, NUM_RESULTS_PER_CALL)
+                pending.append((asyncio.ensure_future(search_base(**kwargs, count=size, time_range=window_range)), size))
+                planned += size
+            if not pending: return
+
+            task, size = pending.pop(0)
+            page = await task or []
+            planned -= size - len(page)     # a short window leaves room for later windows
+            page = page[:count - received]
+            received += len(page)
+            yield page
+            if received >= count: return
+    finally:
+        for task, _ in pending:
+            task.cancel()
+
+
+# Async counterpart of plan_submissions
+async def async_plan_submissions(query=None, title_query=None, selftext_query=None, ids=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    return await async_plan_windows(base_url, kwargs, time_range, printing=printing)
+
+
+# Async counterpart of plan_comments
+async def async_plan_comments(query=None, ids=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+    kwargs = {'query': query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+    return await async_plan_windows(base_url, kwargs, time_range, printing=printing)
+
+
+# Async counterpart of plan_windows
+async def async_plan_windows(base_url, kwargs, time_range, printing=True):
+    a, b = time_range_to_interval(time_range)
+    if a >= b: return []
+
+    start = monotonic()
+    with phase('plan'):
+        buckets = await async_plan_buckets(base_url, kwargs, a, b, printing=printing)
+    windows = list(pack_windows(buckets))
+    emit('plan', windows=len(windows), results=sum(n for _, n in windows), seconds=monotonic() - start)
+    return windows
+
+
+# Async counterpart of plan_buckets; returns the buckets as a list, refining every span and run of dense buckets concurrently
+async def async_plan_buckets(base_url, kwargs, a, b, coarsest='month', printing=True):
+    frequency = choose_frequency(b - a, coarsest=coarsest)
+    spans = await asyncio.gather(*(
+        async_plan_span(base_url, kwargs, frequency, start, end, printing=printing) for start, end in histogram_spans(a, b, frequency)
+    ))
+    return [bucket for buckets in spans for bucket in buckets]
+
+
+# Plan the buckets of one span of at most MAX_HISTOGRAM_BUCKETS buckets at the given frequency (see async_plan_buckets)
+async def async_plan_span(base_url, kwargs, frequency, a, b, printing=True):
+    results = await async_fetch_data(base_url, kwargs=histogram_kwargs(kwargs, frequency, a, b), printing=printing)
+    buckets = parse_histogram(results, frequency, a, b, printing=printing)
+    if frequency == FREQUENCIES[-1]:
+        return buckets
+
+    finer = FREQUENCIES[FREQUENCIES.index(frequency) + 1]
+    parts = split_dense_runs(buckets)
+    refined = await asyncio.gather(*(
+        async_plan_buckets(base_url, kwargs, part[0][0], part[-1][1], coarsest=finer, printing=printing) for part in parts if isinstance(part, list)
+    ))
+    refined = iter(refined)
+    planned = []
+    for part in parts:
+        if isinstance(part, list): planned += next(refined)
+        else: planned.append(part)
+    return planned
+
+
+# Async counterpart of count_submissions
+async def async_count_submissions(query=None, title_query=None, selftext_query=None, ids=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    with phase('count'):
+        results = await async_fetch_data(base_url, kwargs=count_kwargs(kwargs), printing=printing)
+    return parse_count(results, kwargs, printing=printing)
+
+
+# Async counterpart of count_comments
+async def async_count_comments(query=None, ids=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+    kwargs = {'query': query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range}
+    with phase('count'):
+        results = await async_fetch_data(base_url, kwargs=count_kwargs(kwargs), printing=printing)
+    return parse_count(results, kwargs, printing=printing)
+
+
+# Async counterpart of sample_submissions; the sampled days are fetched concurrently
+async def async_sample_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=1000, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, weighting='count', strata=None, seed=None, concurrency=MAX_IN_FLIGHT, stats=None):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range, 'printing': printing}
+    return await async_sample(base_url, async_search_submissions_base, kwargs, count, time_range, weighting, strata, seed, concurrency, stats)
+
+
+# Async counterpart of sample_comments; the sampled days are fetched concurrently
+async def async_sample_comments(query=None, ids=None, count=1000, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, weighting='count', strata=None, seed=None, concurrency=MAX_IN_FLIGHT, stats=None):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'printing': printing}
+    return await async_sample(base_url, async_search_comments_base, kwargs, count, time_range, weighting, strata, seed, concurrency, stats)
+
+
+# Shared body of async_sample_submissions / async_sample_comments (see Sampling.sample)
+async def async_sample(base_url, search_base, kwargs, count, time_range, weighting, strata, seed, concurrency, stats=None):
+    printing = kwargs['printing']
+    predicate = {k: v for k, v in kwargs.items() if k not in ('fields', 'printing')}
+    a, b = time_range_to_interval(time_range)
+
+    if stats is None: stats = Stats()
+    results = []
+    with collect(stats):
+        if a < b:
+            spans = histogram_spans(a, b, 'day')
+            with phase('sample'):
+                histograms = await asyncio.gather(*(async_fetch_data(base_url, kwargs=histogram_kwargs(predicate, 'day', start, end), printing=printing) for start, end in spans))
+            buckets = [bucket for (start, end), histogram in zip(spans, histograms) for bucket in parse_histogram(histogram, 'day', start, end, printing=printing)]
+            rng = random.Random(seed)
+            days, target = plan_strata(buckets, count, weighting=weighting, strata=strata, rng=rng)
+            spans = hour_spans(days)
+            with phase('sample'):
+                histograms = await asyncio.gather(*(async_fetch_data(base_url, kwargs=histogram_kwargs(predicate, 'hour', start, end), printing=printing) for start, end in spans))
+            hours = [bucket for (start, end), histogram in zip(spans, histograms) for bucket in parse_histogram(histogram, 'hour', start, end, printing=printing)]
+            windows = plan_slices(days, hours, rng=rng)
+            async for page in async_fetch_windows(search_base, kwargs, windows, sum(n for _, n in windows), concurrency=concurrency):
+                emit('page', records=len(page))
+                results.extend(page)
+            results = thin(results, target, rng=rng)
+    if printing: print(f'\n{stats.report()}')
+    return results
@@ -0,0 +1,160 @@
+# --- Batched execution of many small queries: coalesce, fetch once, demultiplex locally --- #
+from bisect import bisect_left
+from datetime import timedelta
+
+from RedditAPIWrapper.Main import search_submissions_base, search_comments_base, search_submissions, search_comments, plan_windows, fetch_windows, time_range_to_interval, interval_to_time_range, NUM_RESULTS_PER_CALL
+from RedditAPIWrapper.Utilities import build_url, build_url_params, pack_chunks, MAX_URL_LENGTH
+
+
+BASE_URLS = {'submission': 'https://api.pushshift.io/reddit/search/submission/?', 'comment': 'https://api.pushshift.io/reddit/search/comment/?'}
+ROUTING_FIELDS = ['id', 'subreddit', 'author', 'created_utc']   # fields needed to route merged results back to their queries
+MERGED_PARAMS = ('subreddits', 'authors', 'time_range', 'fields')   # params which may differ between merged queries
+
+
+# Run many queries with as few requests as possible
+# Each spec is a dictionary of search_submissions / search_comments arguments plus 'endpoint': 'submission' or 'comment'
+# Queries which differ only in subreddits, authors, time_range and fields are merged: their subreddit and author lists are
+# combined (as far as the merged url stays within MAX_URL_LENGTH) and time ranges which touch or lie within max_gap of each other
+# are joined into one wider window. Each merged query is fetched once (single page if it fits, otherwise via planned windows)
+# and its records are routed back to every matching spec.
+# Specs with a count, a sort order or ids are run on their own.
+# Returns one list of results per spec, in the order given
+def batch_search(specs, max_gap=timedelta(0), workers=1, printing=True):
+    results = [[] for _ in specs]
+
+    groups = {}
+    for i, spec in enumerate(specs):
+        if spec.get('count') is not None or spec.get('sort_attribute') or spec.get('sort_rev') or spec.get('ids'):
+            kwargs = {k: v for k, v in spec.items() if k != 'endpoint'}
+            search = search_submissions if spec['endpoint'] == 'submission' else search_comments
+            results[i] = search(**kwargs, printing=printing, workers=workers)
+            continue
+        signature = tuple(sorted((k, repr(v)) for k, v in spec.items() if k not in MERGED_PARAMS))
+        groups.setdefault(signature, []).append(i)
+
+    num_merged = 0
+    for indices in groups.values():
+        for cluster in cluster_by_time([specs[i] for i in indices], indices, max_gap):
+            for part in split_by_url_length(specs, cluster):
+                num_merged += 1
+                fetch_merged(specs, part, results, workers=workers, printing=printing)
+
+    if printing: print(f'\nRan {len(specs)} queries as {num_merged} merged queries and {len(specs) - sum(len(v) for v in groups.values())} single queries.')
+    return results
+
+
+# Split the specs of a group into clusters whose time ranges overlap, touch or lie within max_gap of each other
+# Returns a list of clusters, each a list of (spec index, [a, b)) pairs
+def cluster_by_time(group, indices, max_gap):
+    intervals = sorted(((time_range_to_interval(spec.get('time_range', [None, None])), i) for spec, i in zip(group, indices)))
+    clusters = []
+    end = None
+    for (a, b), i in intervals:
+        if a >= b: continue
+        # ranges ending and starting at the same time leave out the second in between ('after' is exclusive), so touch at end + 1
+        if clusters and a <= end + 1 + max_gap.total_seconds():
+            clusters[-1].append((i, (a, b)))
+            end = max(end, b)
+        else:
+            clusters.append([(i, (a, b))])
+            end = b
+    return clusters
+
+
+# Combine a list param across specs; None (unrestricted) in any spec makes the merged param unrestricted
+def merge_list(values):
+    if any(not v for v in values): return None
+    return sorted(set(x for v in values for x in v))
+
+
+# Return the search kwargs of the merged query of a cluster (without time range or count)
+def merged_kwargs(specs, cluster):
+    members = [specs[i] for i, _ in cluster]
+    kwargs = {k: v for k, v in members[0].items() if k not in MERGED_PARAMS and k != 'endpoint'}
+    kwargs['subreddits'] = merge_list([spec.get('subreddits') for spec in members])
+    kwargs['authors'] = merge_list([spec.get('authors') for spec in members])
+    fields = merge_list([spec.get('fields') for spec in members])
+    kwargs['fields'] = sorted(set(fields + ROUTING_FIELDS)) if fields else None
+    return kwargs
+
+
+# Return the url of a single page of the merged query of a cluster
+def merged_url(specs, cluster):
+    a, b = min(interval[0] for _, interval in cluster), max(interval[1] for _, interval in cluster)
+    base_url = BASE_URLS[specs[cluster[0][0]]['endpoint']]
+    return build_url(base_url, build_url_params(**merged_kwargs(specs, cluster), count=NUM_RESULTS_PER_CALL, time_range=interval_to_time_range(a, b)))
+
+
+# Split a cluster (in time order) into consecutive parts whose merged urls fit in MAX_URL_LENGTH
+# A spec whose own url is too long gets a part of its own
+def split_by_url_length(specs, cluster):
+    parts = []
+    for member in sorted(cluster, key=lambda item: item[1]):
+        if parts and len(merged_url(specs, parts[-1] + [member])) <= MAX_URL_LENGTH:
+            parts[-1].append(member)
+        else:
+            parts.append([member])
+    return parts
+
+
+# Fetch one merged query covering every spec in the cluster and route its records into results
+def fetch_merged(specs, cluster, results, workers=1, printing=True):
+    endpoint = specs[cluster[0][0]]['endpoint']
+    base_url = BASE_URLS[endpoint]
+    search_base = search_submissions_base if endpoint == 'submission' else search_comments_base
+
+    a, b = min(interval[0] for _, interval in cluster), max(interval[1] for _, interval in cluster)
+    kwargs = merged_kwargs(specs, cluster)
+    predicate = {k: v for k, v in kwargs.items() if k != 'fields'}
+    probe = {**kwargs, 'count': NUM_RESULTS_PER_CALL, 'time_range': interval_to_time_range(a, b)}
+    kwargs['printing'] = printing
+
+    router = Router(specs, cluster)
+
+    # a single page answers the whole cluster unless it comes back full; a page split across several requests (url too long)
+    # returns the newest results of each request, so the whole range is planned instead
+    oldest = b - 1
+    if len(pack_chunks(base_url, probe)) == 1:
+        page = search_base(**probe, printing=printing)
+        router.route(page)
+        if len(page) < NUM_RESULTS_PER_CALL: return router.collect(results)
+        oldest = min(record['created_utc'] for record in page)
+
+    # plan windows for everything older than the page (including its oldest second again), or for the whole range without one
+    windows = plan_windows(base_url, predicate, interval_to_time_range(a, oldest + 1), printing=printing)
+    for page in fetch_windows(search_base, kwargs, windows, sum(n for _, n in windows), workers=workers):
+        router.route(page)
+    router.collect(results)
+
+
+# Routes records of a merged query to the specs they satisfy
+class Router:
+    def __init__(self, specs, cluster):
+        self.members = []
+        for i, (a, b) in sorted(cluster, key=lambda item: item[1][0]):
+            spec = specs[i]
+            subreddits = set(s.lower() for s in spec['subreddits']) if spec.get('subreddits') else None
+            authors = set(s.lower() for s in spec['authors']) if spec.get('authors') else None
+            self.members.append((a, b, subreddits, authors, spec.get('fields'), i))
+        self.starts = [member[0] for member in self.members]
+        self.max_span = max(b - a for a, b, *_ in self.members)
+        self.routed = {member[5]: [] for member in self.members}
+        self.seen = set()
+
+    def route(self, page):
+        for record in page:
+            if record['id'] in self.seen: continue      # consecutive requests overlap by a second
+            self.seen.add(record['id'])
+            t = record['created_utc']
+            # only specs starting within max_span before t can contain it
+            for k in range(bisect_left(self.starts, t - self.max_span), len(self.members)):
+                a, b, subreddits, authors, fields, i = self.members[k]
+                if a > t: break
+                if t >= b: continue
+                if subreddits is not None and record['subreddit'].lower() not in subreddits: continue
+                if authors is not None and record['author'].lower() not in authors: continue
+                self.routed[i].append({f: record[f] for f in fields if f in record} if fields else record)
+
+    def collect(self, results):
+        for i, records in self.routed.items():
+            results[i] = records
@@ -0,0 +1,193 @@
+# --- Local stand-in for the pushshift.io search endpoints, serving a seeded synthetic data set --- #
+# Use in-process:   set_transport(FakeTransport(FakePushshift().handle))
+# or over HTTP:     python FakePushshift.py --port 8000   and   set_transport(HTTPTransport(host='http://localhost:8000'))
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left, bisect_right
+from collections import deque
+from time import monotonic, sleep
+import argparse
+import calendar
+import gzip
+import json
+import random
+import threading
+import urllib.parse
+
+
+API_HOST = 'https://api.pushshift.io'
+MAX_SIZE = 1000     # the real API never returns more than this many records per call
+FREQUENCY_SECONDS = {'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}
+WORDS = ['the', 'music', 'album', 'song', 'science', 'question', 'answer', 'why', 'how', 'great', 'listen', 'new', 'old', 'best', 'worst', 'really', 'think', 'data', 'reddit', 'post']
+
+
+# Base-36 encoding used for reddit ids
+def to_base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if n == 0: return out
+
+
+# Serves '/reddit/search/submission' and '/reddit/search/comment' requests from a synthetic data set
+#   size, after/before, aggs=created_utc with frequency, metadata, fields, q/title/selftext, ids, author, subreddit, score,
+#   num_comments, sort and sort_type are supported
+#   latency:                 seconds added to every response (plus up to 50% seeded jitter)
+#   max_requests_per_second: respond 429 (with Retry-After) once more requests than this arrive within a second
+#   throttle_rate:           fraction of requests randomly answered with 429
+class FakePushshift:
+    def __init__(self, num_submissions=20000, num_comments=80000, time_range=(datetime(2019, 1, 1), datetime(2020, 1, 1)), num_authors=5000, subreddits=('askscience', 'music', 'jazz', 'metal', 'kpop'), seed=0, latency=0.0, max_requests_per_second=None, throttle_rate=0.0):
+        self.random = random.Random(seed)
+        self.latency, self.max_requests_per_second, self.throttle_rate = latency, max_requests_per_second, throttle_rate
+        self.recent = deque()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+        start, stop = int(time_range[0].timestamp()), int(time_range[1].timestamp())
+        authors = [f'user_{i}' for i in range(num_authors)]
+        self.data = {
+            'submission': self.generate(num_submissions, start, stop, authors, subreddits, submission=True),
+            'comment': self.generate(num_comments, start, stop, authors, subreddits, submission=False)
+        }
+        self.times = {kind: [record['created_utc'] for record in records] for kind, records in self.data.items()}
+
+    # Generate records sorted by created_utc, with a daily cycle and a few bursts so that some hours are much denser than others
+    def generate(self, n, start, stop, authors, subreddits, submission):
+        rand = self.random
+        bursts = [rand.randrange(start, stop) for _ in range(5)]
+        times = []
+        for _ in range(n):
+            if rand.random() < 0.1:
+                t = rand.choice(bursts) + int(rand.expovariate(1 / 600))
+            else:
+                t = rand.randrange(start, stop)
+                if rand.random() < 0.5: t -= (t % 86400) - int(rand.triangular(0, 86400, 72000))  # evening peak
+            times.append(min(max(t, start), stop - 1))
+        times.sort()
+
+        records = []
+        for i, t in enumerate(times):
+            text = ' '.join(rand.choice(WORDS) for _ in range(rand.randint(3, 40)))
+            record = {'id': to_base36(36**5 + i * 7 + (1 if submission else 0)), 'created_utc': t, 'author': authors[int(rand.paretovariate(1.2)) % len(authors)], 'subreddit': rand.choice(subreddits), 'score': int(rand.paretovariate(1.5))}
+            if submission:
+                record.update({'title': text[:80], 'selftext': text, 'num_comments': int(rand.paretovariate(1.3)) - 1})
+            else:
+                record['body'] = text
+            records.append(record)
+        return records
+
+    # Handle a request url; returns (status_code, contents, headers) as expected by Transport.FakeTransport
+    def handle(self, url):
+        with self.lock:
+            self.requests += 1
+            now = monotonic()
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            if self.max_requests_per_second is not None and len(self.recent) >= self.max_requests_per_second:
+                return 429, {'error': 'Too Many Requests'}, {'Retry-After': '1'}
+            if self.throttle_rate and self.random.random() < self.throttle_rate:
+                return 429, {'error': 'Too Many Requests'}, {}
+            self.recent.append(now)
+            jitter = self.random.random() * 0.5
+
+        if self.latency: sleep(self.latency * (1 + jitter))
+
+        path, _, query = url.partition('?')
+        kind = 'submission' if path.rstrip('/').endswith('submission') else 'comment'
+        params = dict(urllib.parse.parse_qsl(query))
+        try:
+            return 200, self.search(kind, params), {}
+        except (KeyError, ValueError) as e:
+            return 400, {'error': str(e)}, {}
+
+    def search(self, kind, params):
+        records, times = self.data[kind], self.times[kind]
+        lo = bisect_right(times, int(params['after'])) if 'after' in params else 0
+        hi = bisect_left(times, int(params['before'])) if 'before' in params else len(times)
+        filters = self.filters(params)
+        matches = [record for record in records[lo:hi] if self.matches(record, filters)]
+
+        contents = {}
+        if params.get('aggs') == 'created_utc':
+            contents['aggs'] = {'created_utc': self.histogram(matches, params.get('frequency', 'month'))}
+        if params.get('metadata') == 'true':
+            contents['metadata'] = {'total_results': len(matches)}
+
+        size = min(int(params.get('size', 25)), MAX_SIZE)
+        sort_type, descending = params.get('sort_type', 'created_utc'), params.get('sort', 'desc') == 'desc'
+        if sort_type == 'created_utc':  # matches are already in time order
+            page = matches[::-1][:size] if descending else matches[:size]
+        else:
+            page = sorted(matches, key=lambda record: record.get(sort_type, 0), reverse=descending)[:size]
+        if 'fields' in params:
+            fields = params['fields'].split(',')
+            page = [{k: record[k] for k in fields if k in record} for record in page]
+        contents['data'] = page
+        return contents
+
+    # Pre-parse the filter params of a request into (field, values), (field, substring) and (field, op, bound) lists
+    def filters(self, params):
+        lists = [('id' if key == 'ids' else key, set(v.lower() for v in params[key].split(','))) for key in ('author', 'subreddit', 'ids') if key in params]
+        texts = [(field, params[key].lower()) for key, field in (('q', None), ('title', 'title'), ('selftext', 'selftext')) if key in params]
+        bounds = [(key, condition[0], int(condition[1:])) for key in ('score', 'num_comments') for condition in params.get(key, '').split(',') if condition]
+        return lists, texts, bounds
+
+    def matches(self, record, filters):
+        lists, texts, bounds = filters
+        for field, values in lists:
+            if record[field].lower() not in values: return False
+        for field, text in texts:     # 'q' (field None) searches the body of comments and the selftext of submissions
+            if text not in record.get(field or ('body' if 'body' in record else 'selftext'), '').lower(): return False
+        for field, op, bound in bounds:
+            value = record.get(field, 0)
+            if (op == '>' and not value > bound) or (op == '<' and not value < bound): return False
+        return True
+
+    def histogram(self, records, frequency):
+        counts = {}
+        for record in records:
+            t = record['created_utc']
+            if frequency == 'month':
+                day = datetime.utcfromtimestamp(t)
+                key = calendar.timegm((day.year, day.month, 1, 0, 0, 0))
+            else:
+                key = t - t % FREQUENCY_SECONDS[frequency]
+            counts[key] = counts.get(key, 0) + 1
+        return [{'key': key, 'doc_count': counts[key]} for key in sorted(counts)]
+
+    # Serve the fake API over HTTP (blocking)
+    def serve(self, port=8000):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status_code, contents, headers = fake.handle(API_HOST + self.path)
+                body = json.dumps(contents).encode()
+                self.send_response(status_code)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header('Content-Encoding', 'gzip')
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        ThreadingHTTPServer(('localhost', port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic pushshift.io stand-in on localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--max-requests-per-second', type=float, default=None)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    FakePushshift(seed=args.seed, latency=args.latency, max_requests_per_second=args.max_requests_per_second, throttle_rate=args.throttle_rate).serve(port=args.port)
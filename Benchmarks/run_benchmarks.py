@@ -0,0 +1,88 @@
+# --- Offline benchmarks against the local pushshift.io stand-in --- #
+# Measures request count, wall time, peak memory and records/s for the search, count, sample, id lookup and url stratification paths
+#   python run_benchmarks.py [--latency 0.05] [--json results.json] [--only search_comments]
+from datetime import datetime
+from time import monotonic
+import argparse
+import json
+import tracemalloc
+
+from FakePushshift import FakePushshift, to_base36
+from RedditAPIWrapper.Main import search_submissions, search_comments, count_submissions, count_comments, lookup_comments
+from RedditAPIWrapper.Metrics import Stats, add_listener, remove_listener
+from RedditAPIWrapper.RateLimit import set_rate_limit
+from RedditAPIWrapper.Sampling import sample_submissions, sample_comments
+from RedditAPIWrapper.Transport import FakeTransport, set_transport
+
+
+TIME_RANGE = [datetime(2019, 1, 1), datetime(2020, 1, 1)]
+AUTHORS = [f'user_{i}' for i in range(3000)]    # long enough that the author list must be split across several urls
+COMMENT_IDS = [to_base36(36**5 + i * 7) for i in range(0, 80000, 4)]   # ids of every fourth comment of the fake data set
+
+
+# name -> function running one benchmark; every function returns the list of records it fetched (or a count)
+BENCHMARKS = {
+    'search_comments': lambda workers: search_comments(time_range=TIME_RANGE, fields=['id', 'author', 'created_utc'], printing=False, workers=workers),
+    'search_comments_columnar': lambda workers: search_comments(time_range=TIME_RANGE, fields=['id', 'author', 'created_utc'], printing=False, workers=workers, columnar=True),
+    'search_submissions': lambda workers: search_submissions(time_range=TIME_RANGE, subreddits=['music', 'jazz'], printing=False, workers=workers),
+    'count_comments': lambda workers: count_comments(time_range=TIME_RANGE, subreddits=['askscience'], printing=False),
+    'count_submissions': lambda workers: count_submissions(query='science', time_range=TIME_RANGE, printing=False),
+    'sample_comments': lambda workers: sample_comments(count=5000, time_range=TIME_RANGE, fields=['id', 'body'], printing=False, workers=workers),
+    'sample_submissions': lambda workers: sample_submissions(count=2000, time_range=TIME_RANGE, printing=False, workers=workers),
+    'lookup_comments': lambda workers: lookup_comments(COMMENT_IDS, fields=['id', 'author'], printing=False, workers=workers),
+    'url_stratification': lambda workers: search_comments(authors=AUTHORS, time_range=TIME_RANGE, count=1000, fields=['id', 'author'], printing=False),
+}
+
+
+# Run a single benchmark against a fresh fake API; returns a dictionary of measurements
+def run_benchmark(name, workers=1, latency=0.0, max_requests_per_second=None, seed=0, fake=None):
+    fake = fake or FakePushshift(seed=seed)
+    fake.latency, fake.max_requests_per_second, fake.requests = latency, max_requests_per_second, 0
+    transport = FakeTransport(fake.handle)
+    set_transport(transport)
+
+    stats = Stats()
+    add_listener(stats)
+    tracemalloc.start()
+    start = monotonic()
+    try:
+        results = BENCHMARKS[name](workers)
+    finally:
+        elapsed = monotonic() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        remove_listener(stats)
+
+    num_records = 0 if isinstance(results, int) else len(results)
+    return {
+        'benchmark': name, 'workers': workers, 'latency': latency,
+        'requests': len(transport.urls), 'retries': stats.retries, 'wall_seconds': round(elapsed, 3),
+        'peak_memory_mb': round(peak / 2**20, 2), 'records': num_records, 'result': results if isinstance(results, int) else None,
+        'records_per_second': round(num_records / elapsed, 1) if elapsed > 0 else 0.0,
+        'seconds_by_phase': {k: round(v, 3) for k, v in stats.to_dict()['seconds_by_phase'].items()}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the offline benchmark suite')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated seconds of latency per request')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--max-requests-per-second', type=float, default=None, help='simulate the API rate limit')
+    parser.add_argument('--only', nargs='+', default=sorted(BENCHMARKS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='also write the measurements to this file')
+    args = parser.parse_args()
+
+    set_rate_limit(1000, max_rate=1000)     # let the fake API (not the client) decide when requests are too fast
+    fake = FakePushshift(seed=args.seed)
+    measurements = []
+    print(f'{"benchmark":<26}{"workers":>8}{"requests":>10}{"retries":>9}{"wall (s)":>10}{"peak (MB)":>11}{"records":>9}{"records/s":>11}')
+    for name in args.only:
+        for workers in args.workers:
+            m = run_benchmark(name, workers=workers, latency=args.latency, max_requests_per_second=args.max_requests_per_second, fake=fake)
+            measurements.append(m)
+            print(f'{name:<26}{workers:>8}{m["requests"]:>10}{m["retries"]:>9}{m["wall_seconds"]:>10}{m["peak_memory_mb"]:>11}{m["records"]:>9}{m["records_per_second"]:>11}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(measurements, f, indent=1)
@@ -0,0 +1,126 @@
+# --- Persistent on-disk cache of API responses, keyed by canonical query parameters --- #
+from hashlib import sha256
+from time import time
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+from RedditAPIWrapper.Decode import loads
+
+
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'RedditAPIWrapper', 'responses.sqlite3')
+CACHE_MAX_BYTES = 2**30         # total size of stored (compressed) responses before least recently used entries are evicted
+CACHE_TTL_SECONDS = 15 * 60     # lifetime of responses for windows which reach the present
+SETTLE_SECONDS = 24 * 60 * 60   # windows ending at least this long ago are treated as immutable
+LIST_PARAMS = ('ids', 'author', 'subreddit', 'fields')  # comma separated params whose order does not matter
+
+
+# Return a canonical key for the given endpoint and url params (as returned by build_url_params)
+def cache_key(url, params):
+    normalized = {}
+    for k, v in params.items():
+        if k in LIST_PARAMS: v = ','.join(sorted(set(str(v).split(','))))
+        normalized[k] = str(v)
+    return sha256(json.dumps([url.rstrip('?'), normalized], sort_keys=True).encode()).hexdigest()
+
+
+# SQLite-backed response store with size-bounded LRU eviction and hit/miss statistics
+# Responses for windows entirely in the past never expire; those reaching the present expire after ttl seconds
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+
+        self.path, self.max_bytes, self.ttl = path, max_bytes, ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, contents BLOB, size INTEGER, expires REAL, last_access REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    # Return the cached json contents for the request, or None on a miss
+    def get(self, url, params):
+        key = cache_key(url, params)
+        now = time()
+        with self.lock:
+            row = self.connection.execute('SELECT contents, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return None
+            self.connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return loads(zlib.decompress(row[0]))
+
+    # Store the raw response body (bytes) for the request
+    def put(self, url, params, contents):
+        key = cache_key(url, params)
+        now = time()
+        before = params.get('before')
+        expires = None if before is not None and int(before) <= now - SETTLE_SECONDS else now + self.ttl
+        compressed = zlib.compress(contents)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, contents, size, expires, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, compressed, len(compressed), expires, now)
+            )
+            self.evict()
+
+    # Drop least recently used entries until the store fits in max_bytes (caller holds the lock)
+    def evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes: return
+
+        stale = []
+        for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            if total <= self.max_bytes: break
+            stale.append((key,))
+            total -= size
+        self.connection.executemany('DELETE FROM responses WHERE key = ?', stale)
+        self.evictions += len(stale)
+
+    # Return a dictionary of cache statistics
+    def stats(self):
+        with self.lock:
+            entries, total = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions, 'entries': entries, 'bytes': total
+        }
+
+    # Remove every stored response
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+cache = None
+
+
+# Return the response cache used by fetch_data, or None if caching is disabled
+def get_cache():
+    return cache
+
+
+# Enable the on-disk response cache for every request made through fetch_data; returns the cache
+def enable_cache(path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+    global cache
+    disable_cache()
+    cache = ResponseCache(path=path, max_bytes=max_bytes, ttl=ttl)
+    return cache
+
+
+# Disable (and close) the response cache
+def disable_cache():
+    global cache
+    if cache is not None:
+        cache.close()
+    cache = None
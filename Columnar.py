@@ -0,0 +1,158 @@
+# --- Compact column-wise container for search results --- #
+from array import array
+from collections import Counter
+import sys
+
+try:
+    import numpy
+except ImportError:     # optional dependency; only needed by to_numpy / to_pandas (filters fall back to pure python)
+    numpy = None
+
+try:
+    import pandas
+except ImportError:     # optional dependency; only needed by to_pandas
+    pandas = None
+
+
+INTERN_MAX_LENGTH = 64      # strings up to this length (authors, subreddits, ids, ...) are interned so repeats share one object
+TYPECODES = {int: 'q', float: 'd'}      # value types stored in typed arrays; anything else is kept in a list
+NUMPY_DTYPES = {'q': 'int64', 'd': 'float64'}
+
+
+# Search results stored column-wise: ints and floats in typed arrays (8 bytes per value), short strings interned, other values in lists
+# Supports len, record-style iteration and indexing (each record is rebuilt as a dictionary), column access by field name,
+# zero-copy export of numeric columns to NumPy / pandas, and vectorized range filters and value counts
+# A field missing from a record is stored (and returned) as None; this moves a numeric field into a list
+class ColumnarResults:
+    def __init__(self, records=()):
+        self.columns = {}
+        self.length = 0
+        self.extend(records)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        columns = list(self.columns.items())
+        for i in range(self.length):
+            yield {field: column[i] for field, column in columns}
+
+    # results[i] is the i-th record as a dictionary; results['field'] is the column of that field
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self.columns and self.length == 0: return []     # an empty search has no columns yet, but every field is empty
+            return self.columns[key]
+        if key < 0: key += self.length
+        if not 0 <= key < self.length: raise IndexError('record index out of range')
+        return {field: column[key] for field, column in self.columns.items()}
+
+    def __repr__(self):
+        return f'ColumnarResults({self.length} records; fields {list(self.columns)})'
+
+    def fields(self):
+        return list(self.columns)
+
+    def append(self, record):
+        n = self.length
+        for field, value in record.items():
+            column = self.columns.get(field)
+            if column is None:
+                column = self.columns[field] = array(TYPECODES[type(value)]) if type(value) in TYPECODES and n == 0 else [None] * n
+            if isinstance(column, array):
+                if type(value) is (int if column.typecode == 'q' else float):
+                    try:
+                        column.append(value)
+                        continue
+                    except OverflowError:
+                        pass
+                column = self.columns[field] = list(column)
+            if type(value) is str and len(value) <= INTERN_MAX_LENGTH: value = sys.intern(value)
+            column.append(value)
+        self.length += 1
+
+        if len(record) < len(self.columns):     # fill in the fields this record lacks
+            for field, column in self.columns.items():
+                if len(column) < self.length:
+                    if isinstance(column, array): column = self.columns[field] = list(column)
+                    column.append(None)
+
+    # Pages whose records all have the container's fields (the usual case for a projected search) are added column by column
+    def extend(self, records):
+        if not isinstance(records, list) or not records:
+            for record in records:
+                self.append(record)
+            return
+        fields = records[0].keys()
+        if (self.length and fields != self.columns.keys()) or any(record.keys() != fields for record in records):
+            for record in records:
+                self.append(record)
+            return
+
+        n = self.length
+        for field in fields:
+            values = [record[field] for record in records]
+            column = self.columns.get(field)
+            if column is None:
+                column = self.columns[field] = array(TYPECODES[type(values[0])]) if type(values[0]) in TYPECODES else []
+            if isinstance(column, array):
+                value_type = int if column.typecode == 'q' else float
+                if all(type(value) is value_type for value in values):
+                    try:
+                        column.extend(values)
+                        continue
+                    except OverflowError:
+                        del column[n:]
+                column = self.columns[field] = list(column)
+            column.extend([sys.intern(value) if type(value) is str and len(value) <= INTERN_MAX_LENGTH else value for value in values])
+        self.length += len(records)
+
+    # Return a new container holding the records at the given indices (a list of ints or an integer NumPy array)
+    def take(self, indices):
+        taken = ColumnarResults()
+        for field, column in self.columns.items():
+            if isinstance(column, array):
+                if numpy is not None:
+                    values = array(column.typecode)
+                    values.frombytes(self.to_numpy(field)[indices].tobytes())
+                else:
+                    values = array(column.typecode, (column[i] for i in indices))
+            else:
+                values = [column[i] for i in indices]
+            taken.columns[field] = values
+        taken.length = len(indices)
+        return taken
+
+    # Return a new container holding the records whose field lies in [low, high] (None endpoints are unbounded)
+    # Runs vectorized over numeric columns when NumPy is available
+    def filter(self, field, low=None, high=None):
+        column = self.columns[field]
+        if numpy is not None and isinstance(column, array):
+            values = self.to_numpy(field)
+            mask = numpy.ones(self.length, dtype=bool)
+            if low is not None: mask &= values >= low
+            if high is not None: mask &= values <= high
+            return self.take(numpy.flatnonzero(mask))
+        return self.take([i for i, value in enumerate(column) if value is not None and (low is None or value >= low) and (high is None or value <= high)])
+
+    # Return a Counter of the values of a field (e.g. records per author)
+    def value_counts(self, field):
+        return Counter(self.columns[field])
+
+    # Return a column as a NumPy array; numeric columns share memory with the container (do not append while using them)
+    def to_numpy(self, field):
+        if numpy is None:
+            raise ImportError('to_numpy requires numpy (pip install numpy)')
+        column = self.columns[field]
+        if isinstance(column, array):
+            return numpy.frombuffer(column, dtype=NUMPY_DTYPES[column.typecode]) if len(column) else numpy.zeros(0, dtype=NUMPY_DTYPES[column.typecode])
+        return numpy.array(column, dtype=object)
+
+    # Return a pandas DataFrame with one column per field; numeric columns are not copied
+    def to_pandas(self):
+        if pandas is None:
+            raise ImportError('to_pandas requires pandas (pip install pandas)')
+        return pandas.DataFrame({field: self.to_numpy(field) for field in self.columns}, copy=False)
+
+    # Return the list of records as dictionaries
+    def to_records(self):
+        return list(self)
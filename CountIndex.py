@@ -0,0 +1,179 @@
+# --- In-memory index of created_utc histograms answering count queries for arbitrary time ranges --- #
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from time import time
+import calendar
+import threading
+
+from RedditAPIWrapper.Cache import CACHE_TTL_SECONDS, SETTLE_SECONDS
+
+
+INDEX_START = calendar.timegm((2005, 6, 1, 0, 0, 0))   # reddit's launch month; the coarsest histogram of a predicate starts here
+INDEX_MAX_BYTES = 64 * 2**20    # memory budget of stored histograms before least recently used ones are evicted
+SEGMENT_OVERHEAD_BYTES = 256    # approximate fixed cost of a stored histogram
+COLD_REFINEMENTS = 1            # uncached finer histograms a count may fetch before a direct count request is cheaper
+
+
+# Histogram of one predicate at one frequency over [lo, hi), kept as arrays of non-empty bucket bounds and cumulative counts
+class Segment:
+    def __init__(self, buckets, lo, hi, fetched_at):
+        self.lo, self.hi, self.fetched_at = lo, hi, fetched_at
+        self.starts = array('q', (start for start, _, _ in buckets))
+        self.ends = array('q', (end for _, end, _ in buckets))
+        self.prefix = array('q', [0])
+        for _, _, num_results in buckets:
+            self.prefix.append(self.prefix[-1] + num_results)
+
+    def size(self):
+        return SEGMENT_OVERHEAD_BYTES + self.starts.itemsize * (len(self.starts) + len(self.ends) + len(self.prefix))
+
+
+# Answers counts over [a, b) from histograms fetched once per predicate, instead of a request per count
+# The coarsest histogram covers everything since INDEX_START; buckets lying entirely inside [a, b) are summed with a binary search
+# over its cumulative counts, and only the (at most two) buckets cut by a or b are refined with a histogram of the next frequency.
+# A refinement is fetched over the whole bucket when a and b fall on the finer buckets' bounds (so later counts can reuse it), and
+# otherwise over just the part of the bucket inside [a, b), which the API clips exactly (e.g. the exclusive 'after' second of a
+# day range), so an edge never costs more than one request. A lookup needing more than COLD_REFINEMENTS uncached refinements is
+# left to a direct count request (count returns None)
+# Histograms reaching the present expire after ttl seconds; the rest never change. Memory is bounded by max_bytes (LRU eviction)
+class CountIndex:
+    def __init__(self, max_bytes=INDEX_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+        self.max_bytes, self.ttl = max_bytes, ttl
+        self.segments = OrderedDict()   # (predicate key, level, lo) -> Segment, least recently used first
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.lookups, self.requests, self.evictions, self.fallbacks = 0, 0, 0, 0
+
+    # Count the results of the predicate identified by key over [a, b) (unix timestamps)
+    #   fetch: function (frequency, lo, hi) returning the chronological (start, end, doc_count) buckets of the predicate's histogram
+    #          over [lo, hi), clipped to [lo, hi), or None if the request failed
+    #   frequencies: histogram frequencies from coarsest to finest; the finest must resolve single seconds
+    #   widths: bucket width in seconds of every frequency but the coarsest
+    # Returns None if a needed histogram could not be fetched, or if the count would take more requests than a direct count
+    def count(self, key, a, b, fetch, frequencies, widths):
+        a = max(a, INDEX_START)
+        if a >= b: return 0
+        with self.lock:
+            self.lookups += 1
+        segment = self.lookup(key, 0, INDEX_START, b)
+        if segment is None:
+            segment = self.fetch_segment(key, 0, INDEX_START, max(b, int(time() + self.ttl)), fetch, frequencies[0])
+            if segment is None: return None
+        total = self.count_segment(key, segment, a, b, fetch, frequencies, widths, 0, [COLD_REFINEMENTS])
+        if total is None:
+            with self.lock:
+                self.fallbacks += 1
+        return total
+
+    # Count [a, b) within a stored histogram of the given level, refining the buckets cut by a or b
+    #   cold: [number of uncached refinements the lookup may still fetch]
+    def count_segment(self, key, segment, a, b, fetch, frequencies, widths, level, cold):
+        starts, ends, prefix = segment.starts, segment.ends, segment.prefix
+        i, j = bisect_right(ends, a), bisect_left(starts, b)   # buckets i..j-1 overlap [a, b)
+        if i >= j: return 0
+
+        edges = []
+        if starts[i] < a:
+            edges.append(i)
+            i += 1
+        if i < j and ends[j - 1] > b:
+            edges.append(j - 1)
+            j -= 1
+        total = prefix[j] - prefix[i] if i < j else 0
+        if not edges: return total
+
+        if level == len(frequencies) - 1:   # cannot be refined further
+            return total + sum(prefix[k + 1] - prefix[k] for k in edges)
+
+        refinements = []
+        for k in edges:
+            lo, hi = max(a, starts[k]), min(b, ends[k])
+            refinements.append((k, lo, hi, self.lookup(key, level + 1, starts[k], hi, lo=lo) or self.lookup(key, level + 1, lo, hi)))
+        if sum(child is None for *_, child in refinements) > cold[0]: return None
+
+        width = widths[frequencies[level + 1]]
+        for k, lo, hi, child in refinements:
+            if child is None:
+                cold[0] -= 1
+                if (lo - starts[k]) % width == 0 and (hi - starts[k]) % width == 0:
+                    child = self.fetch_segment(key, level + 1, starts[k], ends[k], fetch, frequencies[level + 1])
+                else:
+                    child = self.fetch_segment(key, level + 1, lo, hi, fetch, frequencies[level + 1])
+                if child is None: return None
+            partial = self.count_segment(key, child, lo, hi, fetch, frequencies, widths, level + 1, cold)
+            if partial is None: return None
+            total += partial
+        return total
+
+    # Return the stored, unexpired histogram of the level stored under start that covers [lo, hi) (lo defaults to start), or None
+    def lookup(self, key, level, start, hi, lo=None):
+        now = time()
+        with self.lock:
+            segment = self.segments.get((key, level, start))
+            if segment is None or segment.lo > (start if lo is None else lo) or segment.hi < hi or self.expired(segment, now): return None
+            self.segments.move_to_end((key, level, start))
+            return segment
+
+    # Fetch and store the histogram of the level over [lo, hi)
+    def fetch_segment(self, key, level, lo, hi, fetch, frequency):
+        now = time()
+        buckets = fetch(frequency, lo, hi)
+        if buckets is None: return None
+
+        segment = Segment(buckets, lo, hi, now)
+        with self.lock:
+            self.requests += 1
+            old = self.segments.pop((key, level, lo), None)
+            if old is not None: self.bytes -= old.size()
+            self.segments[(key, level, lo)] = segment
+            self.bytes += segment.size()
+            self.evict()
+        return segment
+
+    def expired(self, segment, now):
+        return segment.hi > segment.fetched_at - SETTLE_SECONDS and now - segment.fetched_at > self.ttl
+
+    # Drop least recently used histograms until the index fits in max_bytes (caller holds the lock)
+    def evict(self):
+        while self.bytes > self.max_bytes and len(self.segments) > 1:
+            _, segment = self.segments.popitem(last=False)
+            self.bytes -= segment.size()
+            self.evictions += 1
+
+    # Return a dictionary of index statistics
+    def stats(self):
+        with self.lock:
+            return {
+                'lookups': self.lookups, 'requests': self.requests, 'requests_per_lookup': self.requests / self.lookups if self.lookups else 0.0,
+                'fallbacks': self.fallbacks, 'evictions': self.evictions, 'segments': len(self.segments), 'bytes': self.bytes
+            }
+
+    # Remove every stored histogram
+    def clear(self):
+        with self.lock:
+            self.segments.clear()
+            self.bytes = 0
+
+
+index = None
+
+
+# Return the count index used by count_submissions / count_comments, or None if it is disabled
+def get_count_index():
+    return index
+
+
+# Answer count_submissions / count_comments from the in-memory count index; returns the index
+def enable_count_index(max_bytes=INDEX_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+    global index
+    index = CountIndex(max_bytes=max_bytes, ttl=ttl)
+    return index
+
+
+# Disable (and empty) the count index
+def disable_count_index():
+    global index
+    if index is not None:
+        index.clear()
+    index = None
@@ -0,0 +1,67 @@
+# --- Decoding of API responses: fast json parsing, field pruning and an optional decode process pool --- #
+from concurrent.futures import ProcessPoolExecutor
+import json
+
+try:
+    import orjson
+except ImportError:     # optional dependency; the standard library is used without it
+    orjson = None
+
+
+DECODE_POOL_MIN_BYTES = 256 * 2**10     # responses smaller than this are decoded in the calling thread even when the pool is enabled
+
+
+# Parse a json document (bytes or str) with orjson if installed, otherwise with the standard library
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+# Drop every field not in fields from the records of a response's 'data' (in place); returns the response
+def prune(contents, fields):
+    if not fields or not isinstance(contents, dict) or not contents.get('data'): return contents
+    fields = set(fields)
+    records = contents['data']
+    for i, record in enumerate(records):
+        if not record.keys() <= fields:
+            records[i] = {k: v for k, v in record.items() if k in fields}
+    return contents
+
+
+# Parse a response body, keeping only the given fields (None for all) of its records
+def decode(content, fields=None):
+    return prune(loads(content), fields)
+
+
+pool = None
+
+
+# Return the process pool used to decode large responses, or None if it is disabled
+def get_decode_pool():
+    return pool
+
+
+# Decode a response body in the decode pool if it is enabled and the body is large, otherwise in the calling thread
+# Records are pruned in the worker process, so only the requested fields are sent back
+def decode_response(content, fields=None):
+    if pool is not None and len(content) >= DECODE_POOL_MIN_BYTES:
+        return pool.submit(decode, content, fields).result()
+    return decode(content, fields)
+
+
+# Decode large responses in a pool of worker processes, so parsing runs in parallel with other requests' network I/O
+# instead of holding the interpreter lock; pays off with many workers and without orjson
+def enable_decode_pool(processes=None):
+    global pool
+    disable_decode_pool()
+    pool = ProcessPoolExecutor(max_workers=processes)
+    return pool
+
+
+# Shut down the decode pool; responses are decoded in the calling thread again
+def disable_decode_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown()
+    pool = None
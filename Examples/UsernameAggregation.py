@@ -2,7 +2,9 @@
 from datetime import date, datetime, timedelta
 import os
 
-from PushshiftWrapper import search_submissions, search_comments
+from PushshiftWrapper import search_submissions, search_comments, iter_submissions, iter_comments
+from Analytics import analyze, Summary
+from Batch import batch_search
 from Utilities import write_list_to_file, daterange
 
 
@@ -14,13 +16,25 @@ def get_usernames(subreddit, time_range, printing=True):
         'time_range': time_range,
         'fields': ['author']
     }
-    submissions = search_submissions(**query_kwargs, printing=printing)
-    comments = search_comments(**query_kwargs, printing=printing)
+    submissions = search_submissions(**query_kwargs, printing=printing, columnar=True)
+    comments = search_comments(**query_kwargs, printing=printing, columnar=True)
 
-    submission_authors = [sub['author'] for sub in submissions]
-    comment_authors = [com['author'] for com in comments]
+    return set(submissions['author']) | set(comments['author'])
 
-    return set(submission_authors + comment_authors)
+
+# Takes a list of subreddit names and a list of days (date objects)
+# Returns an estimate of the number of distinct usernames which submitted or commented, and the most active usernames
+# Every (subreddit, day) is summarized on its own and the summaries are merged, so memory stays bounded however many days are covered
+def estimate_usernames(subreddits, days, printing=True):
+    total = Summary()
+    for subreddit in subreddits:
+        for day in days:
+            start_time = datetime.combine(day, datetime.min.time())     # 00:00:00
+            query_kwargs = {'subreddits': [subreddit], 'time_range': [start_time, start_time + timedelta(days=1)], 'fields': ['author']}
+            for iterate in (iter_submissions, iter_comments):
+                total.merge(analyze(iterate(**query_kwargs, printing=printing), text_field=None, processes=0))
+    report = total.report()
+    return report['distinct_authors'], report['top_authors']
 
 
 # Generate a formatted filename for the given subreddit and date
@@ -46,11 +60,29 @@ def fetch_and_save_usernames(subreddit, day, skip_existing=True, printing=True):
     write_list_to_file(filename, sorted_names)
 
 
+# Takes a list of subreddit names and a list of days (date objects)
+# Downloads the usernames for every (subreddit, day) pair not saved yet with a single batch (see Batch.py) and saves them
+# Queries for neighbouring days and different subreddits are merged, so this needs far fewer requests than fetch_and_save_usernames
+def fetch_and_save_usernames_batch(subreddits, days, skip_existing=True, printing=True):
+    pairs = [(subreddit, day) for subreddit in subreddits for day in days if not (skip_existing and os.path.isfile(format_filename(subreddit, day)))]
+
+    specs = []
+    for subreddit, day in pairs:
+        start_time = datetime.combine(day, datetime.min.time())     # 00:00:00
+        query_kwargs = {'subreddits': [subreddit], 'time_range': [start_time, start_time + timedelta(days=1)], 'fields': ['author']}
+        specs.append({'endpoint': 'submission', **query_kwargs})
+        specs.append({'endpoint': 'comment', **query_kwargs})
+    results = batch_search(specs, printing=printing)
+
+    for k, (subreddit, day) in enumerate(pairs):
+        names = set(item['author'] for item in results[2 * k] + results[2 * k + 1])
+        write_list_to_file(format_filename(subreddit, day), sorted(list(names)))
+
+
 if __name__ == '__main__':
     subreddits = ['dubstep', 'metal', 'jazz', 'classicalmusic', 'trap', 'vaporwave', 'kpop', 'indieheads']
     days = list(daterange(date(2017, 1, 1), date.today()))
-    for subreddit in subreddits:
-        for day in days:
-            print(f'Getting usernames from r/{subreddit} on {day}... ', end='', flush=True)
-            fetch_and_save_usernames(subreddit, day, printing=False)
-            print('Done.')
+    for k in range(0, len(days), 30):   # save progress roughly once a month
+        print(f'Getting usernames from {len(subreddits)} subreddits starting {days[k]}... ', end='', flush=True)
+        fetch_and_save_usernames_batch(subreddits, days[k:k + 30], printing=False)
+        print('Done.')
@@ -1,32 +1,24 @@
 # --- Example usage for calculating word frequency within comments --- #
 from PushshiftWrapper import *
-from Utilities import pretty_print
+from Analytics import analyze
 
 
-def get_word_frequency(body_list):
-    frequency = {}
-    for body in body_list:
-        for word in body.split(' '):
-            if word in frequency:
-                frequency[word] += 1
-            else:
-                frequency[word] = 1
-    
-    return frequency
+# Count the words of a stream of comment bodies in a pool of worker processes; returns a Counter of the most common words
+def get_word_frequency(body_list, processes=None):
+    return analyze(({'body': body} for body in body_list), author_field=None, processes=processes).words.counts
 
 
 if __name__ == '__main__':
     a = datetime(2020, 2, 10)
     b = a + timedelta(days=1)
-    results = search_comments(
+    comments = iter_comments(
         count=2000,
         time_range=(a, b),
         subreddits=['the_donald', 'politics'],
-        fields=['body'],
+        fields=['author', 'body'],
         printing=True
     )
-    print(f'{len(results)} results found')
-    pretty_print(results)
-    freq = get_word_frequency(comment['body'] for comment in results)
-    for k, v in sorted(freq.items(), key=lambda item: item[1], reverse=True)[:100]:
+    report = analyze(comments).report(k=100)     # comments are tokenized and counted while they download
+    print(f'{report["records"]} results found; about {report["distinct_authors"]} distinct authors and {report["distinct_words"]} distinct words')
+    for k, v in report['top_words']:
         print(f'{k} => {v}')
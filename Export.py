@@ -0,0 +1,184 @@
+# --- Resumable, checkpointed bulk export of search results to compressed sharded files --- #
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+
+from RedditAPIWrapper.Main import iter_submissions, iter_comments, NUM_RESULTS_LIMIT
+
+
+SHARD_MAX_BYTES = 256 * 2**20   # compressed size at which a shard is closed and a new one started
+MANIFEST_FILENAME = 'manifest.json'
+
+
+# Appends json lines to size-bounded gzip shards named '<prefix>-00000.jsonl.gz', '<prefix>-00001.jsonl.gz', ...
+# Each checkpoint closes the current gzip member, so a shard truncated to its last checkpointed size is a valid gzip file
+class ShardWriter:
+    def __init__(self, directory, prefix, max_bytes=SHARD_MAX_BYTES, index=0, size=0):
+        self.directory, self.prefix, self.max_bytes = directory, prefix, max_bytes
+        self.index = index
+        self.file = open(self.path(index), 'ab')
+        self.file.truncate(size)    # drop anything written after the last checkpoint
+        self.file.seek(size)
+        self.member = None
+
+    def path(self, index):
+        return os.path.join(self.directory, f'{self.prefix}-{index:05d}.jsonl.gz')
+
+    def write(self, record):
+        if self.member is None:
+            self.member = gzip.GzipFile(fileobj=self.file, mode='wb')
+        self.member.write((json.dumps(record) + '\n').encode())
+        if self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.close()
+        self.index += 1
+        self.file = open(self.path(self.index), 'wb')
+
+    # Make everything written so far durable; returns the (index, size) of the current shard
+    def checkpoint(self):
+        if self.member is not None:
+            self.member.close()
+            self.member = None
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.index, self.file.tell()
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+
+# Read a manifest (or return None if the export has not been started)
+def read_manifest(directory):
+    filename = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+# Atomically replace the manifest
+def write_manifest(directory, manifest):
+    filename = os.path.join(directory, MANIFEST_FILENAME)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + '.tmp', filename)
+
+
+# Delete shards started after the last checkpoint (whose shard index is given); the writer truncates the current one
+def remove_uncheckpointed_shards(directory, prefix, index):
+    for filename in os.listdir(directory):
+        if filename.startswith(f'{prefix}-') and filename.endswith('.jsonl.gz') and int(filename[len(prefix) + 1:-len('.jsonl.gz')]) > index:
+            os.remove(os.path.join(directory, filename))
+
+
+# Return a json-serializable description of the query, used to refuse resuming a directory with a different query
+def describe_query(kwargs):
+    return {k: [v.isoformat() if isinstance(v, datetime) else v for v in val] if isinstance(val, (list, tuple)) else val for k, val in kwargs.items()}
+
+
+# Stream the results of `iterate` (iter_submissions or iter_comments) over time_range into gzip shards under directory
+# The time range is exported in chunks of the given length; the manifest records how far each chunk has been exported,
+# so an interrupted export resumes from its last checkpoint without re-downloading (or duplicating) anything
+# Results are fetched in ascending time order; a search cut off at NUM_RESULTS_LIMIT is checkpointed up to its last (possibly partial)
+# second and continued from there, so no range is downloaded twice and no chunk is checkpointed incomplete
+def export(directory, iterate, kwargs, prefix, time_range=[None, None], chunk=timedelta(days=1), shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    time_range = list(time_range)
+    if time_range[0] is None: time_range[0] = datetime(2005, 12, 1)     # approximate start date of data set
+    if time_range[1] is None: time_range[1] = datetime.today()
+
+    os.makedirs(directory, exist_ok=True)
+    description = describe_query({**kwargs, 'start': [time_range[0]], 'chunk_seconds': chunk.total_seconds()})
+    manifest = read_manifest(directory)
+    if manifest is None:
+        manifest = {'query': description, 'prefix': prefix, 'progress': {}, 'shard': [0, 0], 'records': 0}
+    elif manifest['query'] != description:
+        raise ValueError(f'{directory} holds an export of a different query: {manifest["query"]}')
+
+    if kwargs.get('fields'): kwargs = {**kwargs, 'fields': sorted(set(kwargs['fields']) | {'created_utc'})}     # needed to resume a truncated search
+
+    index, size = manifest['shard']
+    remove_uncheckpointed_shards(directory, prefix, index)
+    writer = ShardWriter(directory, prefix, max_bytes=shard_max_bytes, index=index, size=size)
+    try:
+        start = time_range[0]
+        while start < time_range[1]:
+            stop = min(start + chunk, time_range[1])
+            key = str(int(start.timestamp()))
+            done = datetime.fromtimestamp(manifest['progress'].get(key, int(start.timestamp())))
+            while done < stop:
+                if printing: print(f'\nExporting {prefix} from {done.isoformat()} to {stop.isoformat()} ...')
+                num_fetched, held = 0, []     # held: records of the latest second seen, which a truncated search may have cut short
+                chunk_range = [done - timedelta(seconds=1), stop]   # 'after' is exclusive; chunks cover [done, stop)
+                for record in iterate(**kwargs, count=None, time_range=chunk_range, sort_rev=False, printing=printing, workers=workers):
+                    num_fetched += 1
+                    if held and record['created_utc'] > held[0]['created_utc']:
+                        for item in held: writer.write(item)
+                        manifest['records'] += len(held)
+                        held = []
+                    held.append(record)
+
+                if num_fetched < NUM_RESULTS_LIMIT:
+                    for item in held: writer.write(item)
+                    manifest['records'] += len(held)
+                    end = stop
+                else:
+                    # the search stopped at the result limit; continue from the start of its last second, whose records are fetched again
+                    end = datetime.fromtimestamp(held[0]['created_utc'])
+                    if end <= done:
+                        raise RuntimeError(f'{prefix} created at {done.isoformat()} exceed the {NUM_RESULTS_LIMIT} result limit')
+                    if printing: print(f'\nReached the {NUM_RESULTS_LIMIT} result limit; continuing from {end.isoformat()}')
+
+                manifest['shard'] = list(writer.checkpoint())
+                manifest['progress'][key] = int(end.timestamp())
+                write_manifest(directory, manifest)
+                done = end
+            start += chunk
+    finally:
+        writer.close()
+
+    return manifest
+
+
+# Export every submission satisfying the search predicate over time_range to gzip shards under directory (resumable)
+def export_submissions(directory, query=None, title_query=None, selftext_query=None, ids=None, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], chunk=timedelta(days=1), shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    return export(directory, iter_submissions, kwargs, 'submissions', time_range=time_range, chunk=chunk, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing)
+
+
+# Export every comment satisfying the search predicate over time_range to gzip shards under directory (resumable)
+def export_comments(directory, query=None, ids=None, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], chunk=timedelta(days=1), shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+    return export(directory, iter_comments, kwargs, 'comments', time_range=time_range, chunk=chunk, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing)
+
+
+# File wrapper which stops reading after the given number of bytes
+class LimitedReader:
+    def __init__(self, file, limit):
+        self.file, self.remaining = file, limit
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining: size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+# Read the records of an export back in order, streaming one shard at a time
+def read_export(directory):
+    manifest = read_manifest(directory)
+    if manifest is None: return
+    index, size = manifest['shard']
+    for i in range(index + 1):
+        filename = os.path.join(directory, f'{manifest["prefix"]}-{i:05d}.jsonl.gz')
+        if not os.path.isfile(filename): continue
+        with open(filename, 'rb') as raw:
+            limit = size if i == index else os.path.getsize(filename)   # ignore anything written after the last checkpoint
+            with gzip.GzipFile(fileobj=LimitedReader(raw, limit), mode='rb') as f:
+                for line in f:
+                    yield json.loads(line)
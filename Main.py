@@ -1,8 +1,16 @@
 # --- Wrapper functions for accessing the pushshift.io Reddit API --- #
 from datetime import datetime, timedelta
 import concurrent.futures
+from collections import deque
+from time import monotonic
+import calendar
+import contextvars
 
-from RedditAPIWrapper.Utilities import fetch_data
+from RedditAPIWrapper.Cache import cache_key
+from RedditAPIWrapper.Columnar import ColumnarResults
+from RedditAPIWrapper.CountIndex import get_count_index
+from RedditAPIWrapper.Metrics import emit, phase, collect_iter, Stats
+from RedditAPIWrapper.Utilities import fetch_data, build_url, build_url_params, merge_data, map_ordered, pack_values, MAX_URL_LENGTH, STRATIFY_WORKERS
 
 
 # API-related Constants
@@ -16,7 +24,8 @@ def search_submissions_base(query=None, title_query=None, selftext_query=None, i
     base_url = 'https://api.pushshift.io/reddit/search/submission/?'
     kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'count': count, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'num_comments_range': num_comments_range}
     results = fetch_data(base_url, kwargs=kwargs, printing=printing)
-    return [item for res in results for item in res['data']]
+    if len(results) == 1: return results[0]['data']     # the decoded page is handed over as is
+    return merge_data(results, sort_attribute=sort_attribute, sort_rev=sort_rev, count=count, fields=fields)
 
 
 # Access the '/reddit/search/comment' endpoint once to fetch comment data
@@ -25,15 +34,47 @@ def search_comments_base(query=None, ids=None, count=None, fields=None, sort_att
     base_url = 'https://api.pushshift.io/reddit/search/comment/?'
     kwargs = {'query': query, 'ids': ids, 'count': count, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range}
     results = fetch_data(base_url, kwargs=kwargs, printing=printing)
-    return [item for res in results for item in res['data']]
+    if len(results) == 1: return results[0]['data']     # the decoded page is handed over as is
+    return merge_data(results, sort_attribute=sort_attribute, sort_rev=sort_rev, count=count, fields=fields)
 
 
 # Access the '/reddit/search/submission' endpoint repeatedly to fetch submission data (num_results <= count < +inf)
-# Bisects time range and recursively searches the left half (and then the right half if necessary)
-# Concatenates the results (respects sorting)
+# Splits the time range into windows of <= NUM_RESULTS_PER_CALL results (see plan_submissions) and downloads each window
+# Concatenates the results (respects sorting by time)
 #   use None as count for unlimited results
 #   use None as endpoints of ranged attributes for unbounded
-def search_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
+#   use columnar=True to get a ColumnarResults (see Columnar.py) instead of a list of dictionaries
+def search_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, workers=1, stats=None, columnar=False):
+    pages = iter_submissions(
+        query=query, title_query=title_query, selftext_query=selftext_query, ids=ids, count=count, fields=fields, sort_attribute=sort_attribute, sort_rev=sort_rev, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, num_comments_range=num_comments_range, printing=printing, workers=workers, stats=stats, pages=True
+    )
+    results = ColumnarResults() if columnar else []
+    for page in pages:
+        results.extend(page)
+    return results
+
+
+# Access the '/reddit/search/comment' endpoint repeatedly to fetch comment data (num_results <= count < +inf)
+# Splits the time range into windows of <= NUM_RESULTS_PER_CALL results (see plan_comments) and downloads each window
+# Concatenates the results (respects sorting by time)
+#   use None as count for unlimited results
+#   use None as endpoints of ranged attributes for unbounded
+#   use columnar=True to get a ColumnarResults (see Columnar.py) instead of a list of dictionaries
+def search_comments(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, workers=1, stats=None, columnar=False):
+    pages = iter_comments(
+        query=query, ids=ids, count=count, fields=fields, sort_attribute=sort_attribute, sort_rev=sort_rev, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, printing=printing, workers=workers, stats=stats, pages=True
+    )
+    results = ColumnarResults() if columnar else []
+    for page in pages:
+        results.extend(page)
+    return results
+
+
+# Generator counterpart of search_submissions; yields submissions as soon as each window arrives
+# Memory is bounded by roughly one page per worker regardless of count
+#   use pages=True to yield whole pages (lists of submissions) instead of individual submissions
+#   pass a Stats object (see Metrics.py) as stats to collect the search's request metrics; a report is printed if printing
+def iter_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, workers=1, stats=None, pages=False):
     if count is None: count = NUM_RESULTS_LIMIT
     else: count = min(count, NUM_RESULTS_LIMIT)
 
@@ -43,18 +84,18 @@ def search_submissions(query=None, title_query=None, selftext_query=None, ids=No
 
     kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'count': count, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'num_comments_range': num_comments_range, 'printing': printing}
 
-    if count <= NUM_RESULTS_PER_CALL:
-        return search_submissions_base(**kwargs)
-    
-    return search_submissions_helper(**kwargs)
+    if stats is None: stats = Stats()
+    for page in collect_iter(search_pages(search_submissions_base, iter_submissions_helper, kwargs, workers=workers), stats):
+        if pages: yield page
+        else: yield from page
+    if printing: print(f'\n{stats.report()}')
 
 
-# Access the '/reddit/search/comment' endpoint repeatedly to fetch comment data (num_results <= count < +inf)
-# Bisects time range and recursively searches the left half (and then the right half if necessary)
-# Concatenates the results (respects sorting)
-#   use None as count for unlimited results
-#   use None as endpoints of ranged attributes for unbounded
-def search_comments(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
+# Generator counterpart of search_comments; yields comments as soon as each window arrives
+# Memory is bounded by roughly one page per worker regardless of count
+#   use pages=True to yield whole pages (lists of comments) instead of individual comments
+#   pass a Stats object (see Metrics.py) as stats to collect the search's request metrics; a report is printed if printing
+def iter_comments(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, workers=1, stats=None, pages=False):
     if count is None: count = NUM_RESULTS_LIMIT
     else: count = min(count, NUM_RESULTS_LIMIT)
     
@@ -64,62 +105,137 @@ def search_comments(query=None, ids=None, count=None, fields=None, sort_attribut
 
     kwargs = {'query': query, 'ids': ids, 'count': count, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'printing': printing}
 
-    if count <= NUM_RESULTS_PER_CALL:
-        return search_comments_base(**kwargs)
-    
-    return search_comments_helper(**kwargs)
+    if stats is None: stats = Stats()
+    for page in collect_iter(search_pages(search_comments_base, iter_comments_helper, kwargs, workers=workers), stats):
+        if pages: yield page
+        else: yield from page
+    if printing: print(f'\n{stats.report()}')
+
+
+# Yield the pages of a search (a single page if count <= NUM_RESULTS_PER_CALL), reporting each as a 'page' event
+def search_pages(search_base, search_helper, kwargs, workers=1):
+    if kwargs['count'] <= NUM_RESULTS_PER_CALL:
+        pages = [search_base(**kwargs)]
+    else:
+        pages = search_helper(**kwargs, workers=workers)
+    for page in pages:
+        emit('page', records=len(page))
+        yield page
 
 
 # Helper function for search_submissions
-def search_submissions_helper(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
-    num_results = count_submissions(
-        query=query, title_query=title_query, selftext_query=selftext_query, ids=ids, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, num_comments_range=num_comments_range, printing=printing
+def search_submissions_helper(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, workers=1):
+    pages = iter_submissions_helper(
+        query=query, title_query=title_query, selftext_query=selftext_query, ids=ids, count=count, fields=fields, sort_attribute=sort_attribute, sort_rev=sort_rev, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, num_comments_range=num_comments_range, printing=printing, workers=workers
     )
-
-    if num_results == 0: return []
-    
-    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range, 'printing': printing}
-    
-    if num_results > NUM_RESULTS_PER_CALL:
-        if printing: print(f'\nSubmissions found: {num_results}. Bisecting time range...')
-        a, b = time_range
-        midpoint = a + (b - a) / 2
-        left_results = search_submissions_helper(**kwargs, count=count, time_range=[a, midpoint])
-        remaining = count - len(left_results)
-        if remaining > 0:
-            right_results = search_submissions_helper(**kwargs, count=remaining, time_range=[midpoint, b])
-        else:
-            right_results = []
-        return left_results + right_results
-    else:
-        if printing: print(f'\nDownloading {min(count, num_results)} submissions now...')
-        return search_submissions_base(**kwargs, count=count, time_range=time_range)
+    return [item for page in pages for item in page]
 
 
 # Helper function for search_comments
-def search_comments_helper(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
-    num_results = count_comments(
-        query=query, ids=ids, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, printing=printing
+def search_comments_helper(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, workers=1):
+    pages = iter_comments_helper(
+        query=query, ids=ids, count=count, fields=fields, sort_attribute=sort_attribute, sort_rev=sort_rev, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, printing=printing, workers=workers
     )
+    return [item for page in pages for item in page]
 
-    if num_results == 0: return []
-    
-    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'printing': printing}
-    
-    if num_results > NUM_RESULTS_PER_CALL:
-        if printing: print(f'\nComments found: {num_results}. Bisecting time range...')
-        a, b = time_range
-        midpoint = a + (b - a) / 2
-        left_results = search_comments_helper(**kwargs, count=count, time_range=[a, midpoint])
-        remaining = count - len(left_results)
-        if remaining > 0:
-            right_results = search_comments_helper(**kwargs, count=remaining, time_range=[midpoint, b])
-        else:
-            right_results = []
-        return left_results + right_results
-    else:
-        if printing: print(f'\nDownloading {min(count, num_results)} comments now...')
-        return search_comments_base(**kwargs, count=count, time_range=time_range)
+
+# Helper function for iter_submissions; yields pages of submissions
+# Plans <= NUM_RESULTS_PER_CALL windows from histograms while downloading them (concurrently if workers > 1), in the order the results are
+# requested, so planning stops as soon as the planned windows cover count
+def iter_submissions_helper(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, workers=1):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+
+    predicate = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    kwargs = {**predicate, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'printing': printing}
+
+    reverse = bool(sort_rev) and sort_attribute in (None, 'created_utc')    # newest window first when results are requested in descending time order
+    windows = iter_windows(base_url, predicate, time_range, reverse=reverse, printing=printing)
+
+    try:
+        yield from fetch_windows(search_submissions_base, kwargs, windows, count, workers=workers, name='submissions')
+    finally:
+        windows.close()
+
+
+# Helper function for iter_comments; yields pages of comments
+# Plans <= NUM_RESULTS_PER_CALL windows from histograms while downloading them (concurrently if workers > 1), in the order the results are
+# requested, so planning stops as soon as the planned windows cover count
+def iter_comments_helper(query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, workers=1):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+
+    predicate = {'query': query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+    kwargs = {**predicate, 'fields': fields, 'sort_attribute': sort_attribute, 'sort_rev': sort_rev, 'printing': printing}
+
+    reverse = bool(sort_rev) and sort_attribute in (None, 'created_utc')    # newest window first when results are requested in descending time order
+    windows = iter_windows(base_url, predicate, time_range, reverse=reverse, printing=printing)
+
+    try:
+        yield from fetch_windows(search_comments_base, kwargs, windows, count, workers=workers, name='comments')
+    finally:
+        windows.close()
+
+
+# Fetch the planned time windows with a bounded pool of worker threads; yields each window's results in window order
+# At most `workers` windows are in flight at once and new windows are only submitted while the planned total falls short of count,
+# so outstanding work is cancelled as soon as count is satisfied. All requests share the process-wide rate limit (see RateLimit.py)
+# Note: windows partition the time range, so the merged order only respects sorting by time (created_utc)
+def fetch_windows(search_base, kwargs, windows, count, workers=1, name='results'):
+    printing = kwargs.get('printing', True)
+    windows = iter(windows)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    received, planned = 0, 0    # planned counts results expected from windows already submitted
+    try:
+        while True:
+            while len(pending) < workers and planned < count:
+                window = next(windows, None)
+                if window is None: break
+                window_range, num_results = window
+                size = min(count - planned, num_results, NUM_RESULTS_PER_CALL)
+                if printing: print(f'\nDownloading {size} {name} now...')
+                context = contextvars.copy_context()    # carry the caller's metrics context into the worker thread
+                pending.append((executor.submit(context.run, search_base, **kwargs, count=size, time_range=window_range), size))
+                planned += size
+            if not pending: return
+
+            future, size = pending.popleft()
+            page = future.result() or []
+            planned -= size - len(page)     # a short window leaves room for later windows
+            page = page[:count - received]
+            received += len(page)
+            yield page
+            if received >= count: return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Fetch the submissions with the given base-36 ids (any number of them; repeated ids are fetched once)
+# The ids are packed into as few url-length-safe requests of <= NUM_RESULTS_PER_CALL ids as possible, fetched `workers` at a time
+#   use columnar=True to get a ColumnarResults (see Columnar.py) instead of a list of dictionaries
+def lookup_submissions(ids, fields=None, printing=True, workers=STRATIFY_WORKERS, columnar=False):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+    return lookup(base_url, search_submissions_base, ids, fields=fields, printing=printing, workers=workers, columnar=columnar)
+
+
+# Fetch the comments with the given base-36 ids (any number of them; repeated ids are fetched once)
+# The ids are packed into as few url-length-safe requests of <= NUM_RESULTS_PER_CALL ids as possible, fetched `workers` at a time
+#   use columnar=True to get a ColumnarResults (see Columnar.py) instead of a list of dictionaries
+def lookup_comments(ids, fields=None, printing=True, workers=STRATIFY_WORKERS, columnar=False):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+    return lookup(base_url, search_comments_base, ids, fields=fields, printing=printing, workers=workers, columnar=columnar)
+
+
+# Shared body of lookup_submissions / lookup_comments
+def lookup(base_url, search_base, ids, fields=None, printing=True, workers=STRATIFY_WORKERS, columnar=False):
+    capacity = MAX_URL_LENGTH - len(build_url(base_url, build_url_params(count=NUM_RESULTS_PER_CALL, fields=fields))) - len('&ids=') + 1
+    chunks = pack_values(ids, capacity, max_values=NUM_RESULTS_PER_CALL)
+    if printing: print(f'\nLooking up {sum(len(chunk) for chunk in chunks)} ids with {len(chunks)} requests...')
+
+    results = ColumnarResults() if columnar else []
+    for page in map_ordered(lambda chunk: search_base(ids=chunk, count=len(chunk), fields=fields, printing=printing), chunks, workers=workers):
+        emit('page', records=len(page))
+        results.extend(page)
+    return results
 
 
 # Count the number of submissions satisfying the search predicate; slight abuse of the aggregation feature
@@ -129,20 +245,8 @@ def count_submissions(query=None, title_query=None, selftext_query=None, ids=Non
 
     kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'num_comments_range': num_comments_range}
 
-    if query:   # look in metadata for total number of results
-        kwargs['size'], kwargs['metadata'] = 0, True
-        results = fetch_data(base_url, kwargs=kwargs, printing=printing)
-        total = sum(res['metadata']['total_results'] for res in results)
-    else:       # abuse the aggregation feature to sum results over time range
-        kwargs['aggs'], kwargs['frequency'] = 'created_utc', 'month'
-        results = fetch_data(base_url, kwargs=kwargs, printing=printing)
-        try:
-            total = sum(item['doc_count'] for res in results for item in res['aggs']['created_utc'])
-        except Exception as e:
-            total = 0
-            if printing: print(f'EXCEPTION: {e}')
-    
-    return total
+    with phase('count'):
+        return count_results(base_url, kwargs, printing=printing)
 
 
 # Count the number of comments satisfying the search predicate; slight abuse of the aggregation feature
@@ -152,17 +256,219 @@ def count_comments(query=None, ids=None, authors=None, subreddits=None, time_ran
 
     kwargs = {'query': query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range}
 
-    if query:   # look in metadata for total number of results
-        kwargs['size'], kwargs['metadata'] = 0, True
-        results = fetch_data(base_url, kwargs=kwargs, printing=printing)
-        total = sum(res['metadata']['total_results'] for res in results)
-    else:       # abuse the aggregation feature to sum results over time range
-        kwargs['aggs'], kwargs['frequency'] = 'created_utc', 'month'
-        results = fetch_data(base_url, kwargs=kwargs, printing=printing)
-        try:
-            total = sum(item['doc_count'] for res in results for item in res['aggs']['created_utc'])
-        except Exception as e:
-            total = 0
-            if printing: print(f'EXCEPTION: {e}')
-    
-    return total
+    with phase('count'):
+        return count_results(base_url, kwargs, printing=printing)
+
+
+# Count the results of the search predicate given by fetch_data kwargs
+# Answered from the count index when it is enabled (see CountIndex.py), otherwise with a single count request
+def count_results(base_url, kwargs, printing=True):
+    index = get_count_index()
+    if index is not None:
+        predicate = {k: v for k, v in kwargs.items() if k != 'time_range'}
+        a, b = time_range_to_interval(kwargs['time_range'])
+        fetch = lambda frequency, lo, hi: fetch_index_histogram(base_url, predicate, frequency, lo, hi, printing=printing)
+        total = index.count(cache_key(base_url, build_url_params(**predicate)), a, b, fetch, FREQUENCIES, FREQUENCY_SECONDS)
+        if total is not None: return total
+
+    results = fetch_data(base_url, kwargs=count_kwargs(kwargs), printing=printing)
+    return parse_count(results, kwargs, printing=printing)
+
+
+# Return the fetch_data kwargs for counting the results of the search predicate given by kwargs
+def count_kwargs(kwargs):
+    if kwargs.get('query'):     # look in metadata for total number of results
+        return {**kwargs, 'size': 0, 'metadata': True}
+    return {**kwargs, 'size': 0, 'aggs': 'created_utc', 'frequency': 'month'}     # abuse the aggregation feature to sum results over time range
+
+
+# Convert the responses to a count request (see count_kwargs) into the total number of results
+def parse_count(results, kwargs, printing=True):
+    try:
+        if kwargs.get('query'):
+            return sum(res['metadata']['total_results'] for res in results)
+        return sum(item['doc_count'] for res in results for item in res['aggs']['created_utc'])
+    except Exception as e:
+        if printing: print(f'EXCEPTION: {e}')
+        return 0
+
+
+# Plan the time windows needed to download every submission satisfying the search predicate
+# Returns a list of (time_range, num_results) pairs in chronological order, each with num_results <= NUM_RESULTS_PER_CALL
+# (a single second holding more than NUM_RESULTS_PER_CALL results cannot be split and is returned as one oversized window)
+def plan_submissions(query=None, title_query=None, selftext_query=None, ids=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
+
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range}
+
+    return plan_windows(base_url, kwargs, time_range, printing=printing)
+
+
+# Plan the time windows needed to download every comment satisfying the search predicate
+# Returns a list of (time_range, num_results) pairs in chronological order, each with num_results <= NUM_RESULTS_PER_CALL
+# (a single second holding more than NUM_RESULTS_PER_CALL results cannot be split and is returned as one oversized window)
+def plan_comments(query=None, ids=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
+    base_url = 'https://api.pushshift.io/reddit/search/comment/?'
+
+    kwargs = {'query': query, 'ids': ids, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+
+    return plan_windows(base_url, kwargs, time_range, printing=printing)
+
+
+# Histogram granularities supported by the aggregation feature, from coarsest to finest
+# Bucket widths are in seconds; months vary in length and are handled separately
+FREQUENCIES = ['month', 'day', 'hour', 'minute', 'second']
+FREQUENCY_SECONDS = {'month': 31 * 86400, 'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}
+MAX_HISTOGRAM_BUCKETS = 2000    # upper bound on the number of buckets requested in a single histogram
+
+
+# Choose the finest frequency whose histogram over the given span stays within MAX_HISTOGRAM_BUCKETS
+# (if even the coarsest candidate does not fit, it is returned and the span must be split, see histogram_spans)
+def choose_frequency(span_seconds, coarsest='month'):
+    candidates = FREQUENCIES[FREQUENCIES.index(coarsest):]
+    for frequency in reversed(candidates):
+        if span_seconds / FREQUENCY_SECONDS[frequency] <= MAX_HISTOGRAM_BUCKETS:
+            return frequency
+    return candidates[0]
+
+
+# Split [a, b) into consecutive spans whose histograms at the given frequency hold at most MAX_HISTOGRAM_BUCKETS buckets
+# Returns a chronological list of (start, end) pairs (newest first if reverse)
+def histogram_spans(a, b, frequency, reverse=False):
+    step = (MAX_HISTOGRAM_BUCKETS - 1) * FREQUENCY_SECONDS[frequency]     # an unaligned span touches one extra bucket
+    spans = [(start, min(start + step, b)) for start in range(a, b, step)]
+    return spans[::-1] if reverse else spans
+
+
+# Return the (exclusive) end timestamp of the histogram bucket starting at the given timestamp
+def bucket_end(start, frequency):
+    if frequency == 'month':
+        day = datetime.utcfromtimestamp(start)
+        year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+        return calendar.timegm((year, month, 1, 0, 0, 0))
+    return start + FREQUENCY_SECONDS[frequency]
+
+
+# Convert the half-open interval [a, b) of unix timestamps to a time_range (the API treats 'after' and 'before' as exclusive)
+def interval_to_time_range(a, b):
+    return [datetime.fromtimestamp(a - 1), datetime.fromtimestamp(b)]
+
+
+# Fetch a created_utc histogram over [a, b) (unix timestamps) at the given frequency
+# Returns a chronological list of (start, end, doc_count) buckets clipped to [a, b)
+def fetch_histogram(base_url, kwargs, frequency, a, b, printing=True):
+    results = fetch_data(base_url, kwargs=histogram_kwargs(kwargs, frequency, a, b), printing=printing)
+    return parse_histogram(results, frequency, a, b, printing=printing)
+
+
+# Fetch a histogram for the count index; like fetch_histogram, but returns None if the request failed
+def fetch_index_histogram(base_url, kwargs, frequency, a, b, printing=True):
+    results = fetch_data(base_url, kwargs=histogram_kwargs(kwargs, frequency, a, b), printing=printing)
+    if results is None: return None
+    return parse_histogram(results, frequency, a, b, printing=printing)
+
+
+# Return the fetch_data kwargs requesting a created_utc histogram over [a, b) at the given frequency
+def histogram_kwargs(kwargs, frequency, a, b):
+    return {**kwargs, 'time_range': interval_to_time_range(a, b), 'size': 0, 'aggs': 'created_utc', 'frequency': frequency}
+
+
+# Convert the responses to a histogram request into a chronological list of non-empty (start, end, doc_count) buckets clipped to [a, b)
+def parse_histogram(results, frequency, a, b, printing=True):
+    counts = {}
+    try:
+        for res in results:     # a long url may have been stratified into several requests; merge their buckets
+            for item in res['aggs']['created_utc']:
+                counts[item['key']] = counts.get(item['key'], 0) + item['doc_count']
+    except Exception as e:
+        if printing: print(f'EXCEPTION: {e}')
+        return []
+
+    buckets = []
+    for start in sorted(counts):
+        if counts[start] == 0: continue
+        buckets.append((max(start, a), min(bucket_end(start, frequency), b), counts[start]))
+    return buckets
+
+
+# Split buckets into sparse buckets (<= NUM_RESULTS_PER_CALL results) and runs of consecutive dense buckets
+# Returns a chronological list whose items are either a single sparse bucket or a list of dense buckets
+def split_dense_runs(buckets):
+    parts = []
+    for bucket in buckets:
+        if bucket[2] <= NUM_RESULTS_PER_CALL:
+            parts.append(bucket)
+        elif parts and isinstance(parts[-1], list) and parts[-1][-1][1] == bucket[0]:
+            parts[-1].append(bucket)
+        else:
+            parts.append([bucket])
+    return parts
+
+
+# Yield the non-empty histogram buckets over [a, b) in chronological order (newest first if reverse), each holding <= NUM_RESULTS_PER_CALL results where possible
+# Starts from a coarse histogram and re-requests finer histograms only for runs of buckets which are too dense. No histogram holds more
+# than MAX_HISTOGRAM_BUCKETS buckets, and each is requested only once the buckets before it were consumed, so stopping early stops planning
+def plan_buckets(base_url, kwargs, a, b, coarsest='month', reverse=False, printing=True):
+    frequency = choose_frequency(b - a, coarsest=coarsest)
+    for start, end in histogram_spans(a, b, frequency, reverse=reverse):
+        with phase('plan'):
+            buckets = fetch_histogram(base_url, kwargs, frequency, start, end, printing=printing)
+        if frequency == FREQUENCIES[-1]:
+            yield from (buckets[::-1] if reverse else buckets)
+            continue
+
+        finer = FREQUENCIES[FREQUENCIES.index(frequency) + 1]
+        parts = split_dense_runs(buckets)
+        for part in (parts[::-1] if reverse else parts):
+            if isinstance(part, list):      # consecutive dense buckets are refined together (within MAX_HISTOGRAM_BUCKETS finer buckets)
+                if printing: print(f'\n{len(part)} dense {frequency} bucket(s) found. Refining histogram...')
+                yield from plan_buckets(base_url, kwargs, part[0][0], part[-1][1], coarsest=finer, reverse=reverse, printing=printing)
+            else:
+                yield part
+
+
+# Greedily pack consecutive buckets (in either time order) into time windows holding at most NUM_RESULTS_PER_CALL results each
+# Yields (time_range, num_results) pairs in the order of the buckets
+def pack_windows(buckets):
+    window = None
+    for start, end, num_results in buckets:
+        if window and window[2] + num_results <= NUM_RESULTS_PER_CALL:
+            window = [min(window[0], start), max(window[1], end), window[2] + num_results]
+        else:
+            if window: yield (interval_to_time_range(window[0], window[1]), window[2])
+            window = [start, end, num_results]
+    if window: yield (interval_to_time_range(window[0], window[1]), window[2])
+
+
+# Plan the <= NUM_RESULTS_PER_CALL time windows covering the search predicate (given as fetch_data kwargs) over time_range
+def plan_windows(base_url, kwargs, time_range, printing=True):
+    return list(iter_windows(base_url, kwargs, time_range, printing=printing))
+
+
+# Lazy counterpart of plan_windows; yields the windows in chronological order (newest first if reverse) while planning them
+# The 'plan' event is emitted once the generator is exhausted or closed, covering only the windows planned so far
+def iter_windows(base_url, kwargs, time_range, reverse=False, printing=True):
+    a, b = time_range_to_interval(time_range)
+    if a >= b: return
+
+    windows = pack_windows(plan_buckets(base_url, kwargs, a, b, reverse=reverse, printing=printing))
+    num_windows, num_results, seconds = 0, 0, 0.0
+    try:
+        while True:
+            start = monotonic()
+            window = next(windows, None)
+            seconds += monotonic() - start
+            if window is None: break
+            num_windows, num_results = num_windows + 1, num_results + window[1]
+            yield window
+    finally:
+        windows.close()
+        emit('plan', windows=num_windows, results=num_results, seconds=seconds)
+
+
+# Convert a time_range (None endpoints allowed) to the half-open interval [a, b) of unix timestamps it covers
+def time_range_to_interval(time_range):
+    time_range = list(time_range)
+    if time_range[0] is None: time_range[0] = datetime(2005, 12, 1)     # approximate start date of data set
+    if time_range[1] is None: time_range[1] = datetime.today()
+    return int(time_range[0].timestamp()) + 1, int(time_range[1].timestamp())    # 'after' is exclusive
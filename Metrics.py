@@ -0,0 +1,149 @@
+# --- Structured instrumentation of API requests and searches --- #
+from contextlib import contextmanager
+from time import monotonic
+import contextvars
+import threading
+
+
+# Events emitted by the library (each is a dictionary with an 'event' key):
+#   'request'    one HTTP request or cache hit; url, phase, status, latency, bytes, attempt, cached
+#   'rate_wait'  time spent blocked by the shared rate limiter; seconds
+#   'throttle'   a 'Too Many Requests' response; seconds (back-off before the retry), attempt
+#   'error'      a request which failed critically; url, phase, error
+#   'plan'       a planned search; windows, results, seconds
+#   'page'       a page of results handed to the caller; records
+listeners = []
+current_phase = contextvars.ContextVar('current_phase', default='download')     # 'count', 'plan', 'sample' or 'download'
+current_stats = contextvars.ContextVar('current_stats', default=None)           # Stats collecting events for the current search
+
+
+# Register a callback receiving every event (e.g. a Stats object, or a function exporting to a metrics system)
+def add_listener(listener):
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    listeners.remove(listener)
+
+
+# Send an event to the current search's Stats (if any) and every registered listener
+def emit(event, **fields):
+    fields['event'] = event
+    if 'phase' not in fields: fields['phase'] = current_phase.get()
+    stats = current_stats.get()
+    if stats is not None: stats(fields)
+    for listener in listeners:
+        listener(fields)
+
+
+# Attribute requests made within the block to the given phase
+@contextmanager
+def phase(name):
+    token = current_phase.set(name)
+    try:
+        yield
+    finally:
+        current_phase.reset(token)
+
+
+# Collect the events of requests made within the block (including worker threads started from it) into stats
+@contextmanager
+def collect(stats):
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        stats.finish()
+        current_stats.reset(token)
+
+
+# Drive a generator inside its own context collecting its events into stats; yields the generator's items
+# (setting current_stats inside a generator would leak into the caller's context between items)
+def collect_iter(generator, stats):
+    context = contextvars.copy_context()
+    context.run(current_stats.set, stats)
+    try:
+        while True:
+            try:
+                item = context.run(next, generator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(generator.close)
+        stats.finish()
+
+
+# Thread-safe aggregate of events; usable as a listener (see add_listener) or as the stats of a single search
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started, self.finished = monotonic(), None
+        self.requests, self.cache_hits, self.errors, self.retries = 0, 0, 0, 0
+        self.bytes = 0
+        self.status_codes = {}
+        self.requests_by_phase, self.seconds_by_phase = {}, {}
+        self.rate_wait_seconds, self.throttle_seconds = 0.0, 0.0
+        self.latencies = []
+        self.windows, self.planned_results, self.records = 0, 0, 0
+
+    def __call__(self, event):
+        with self.lock:
+            kind = event['event']
+            if kind == 'request':
+                if event.get('cached'):
+                    self.cache_hits += 1
+                    return
+                self.requests += 1
+                self.bytes += event.get('bytes', 0)
+                self.status_codes[event['status']] = self.status_codes.get(event['status'], 0) + 1
+                self.requests_by_phase[event['phase']] = self.requests_by_phase.get(event['phase'], 0) + 1
+                self.seconds_by_phase[event['phase']] = self.seconds_by_phase.get(event['phase'], 0.0) + event['latency']
+                self.latencies.append(event['latency'])
+            elif kind == 'rate_wait':
+                self.rate_wait_seconds += event['seconds']
+            elif kind == 'throttle':
+                self.retries += 1
+                self.throttle_seconds += event['seconds']
+            elif kind == 'error':
+                self.errors += 1
+            elif kind == 'plan':
+                self.windows += event['windows']
+                self.planned_results += event['results']
+            elif kind == 'page':
+                self.records += event['records']
+
+    def finish(self):
+        self.finished = monotonic()
+
+    def elapsed(self):
+        return (self.finished or monotonic()) - self.started
+
+    def latency_percentile(self, p):
+        if not self.latencies: return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    # Return a json-serializable summary
+    def to_dict(self):
+        with self.lock:
+            elapsed = self.elapsed()
+            return {
+                'elapsed_seconds': elapsed, 'requests': self.requests, 'cache_hits': self.cache_hits, 'errors': self.errors, 'retries': self.retries,
+                'bytes': self.bytes, 'status_codes': dict(self.status_codes),
+                'requests_by_phase': dict(self.requests_by_phase), 'seconds_by_phase': dict(self.seconds_by_phase),
+                'rate_wait_seconds': self.rate_wait_seconds, 'throttle_seconds': self.throttle_seconds,
+                'latency_p50': self.latency_percentile(50), 'latency_p95': self.latency_percentile(95),
+                'windows': self.windows, 'planned_results': self.planned_results, 'records': self.records,
+                'records_per_second': self.records / elapsed if elapsed > 0 else 0.0
+            }
+
+    # Return a short human-readable report
+    def report(self):
+        d = self.to_dict()
+        phases = ', '.join(f'{name} {d["requests_by_phase"][name]} ({round(d["seconds_by_phase"][name], 2)}s)' for name in sorted(d['requests_by_phase']))
+        return '\n'.join([
+            f'Requests: {d["requests"]} [{phases or "none"}]; {d["cache_hits"]} cache hits; {d["errors"]} errors; {round(d["bytes"] / 2**20, 2)} MB received; status codes {d["status_codes"]}',
+            f'Waiting: {round(d["rate_wait_seconds"], 2)}s rate limit, {round(d["throttle_seconds"], 2)}s back-off over {d["retries"]} retries; latency p50 {round(d["latency_p50"], 3)}s, p95 {round(d["latency_p95"], 3)}s',
+            f'Results: {d["records"]} records from {d["windows"]} windows in {round(d["elapsed_seconds"], 2)}s ({round(d["records_per_second"], 1)} records/s)'
+        ])
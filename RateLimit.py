@@ -0,0 +1,101 @@
+# --- Process-wide adaptive request rate limiting for the pushshift.io API --- #
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep, time
+import threading
+
+
+MAX_REQUESTS_PER_SECOND = 2.0   # initial shared budget across all threads issuing requests
+MIN_RATE = 0.1                  # the learned rate never drops below this (requests per second)
+MAX_RATE = 20.0                 # ... nor rises above this
+BURST = 2                       # number of requests which may be sent back-to-back after an idle period
+ADDITIVE_INCREASE = 0.05        # requests per second added after each fast successful request
+MULTIPLICATIVE_DECREASE = 0.5   # factor applied to the rate on a 'Too Many Requests' response
+LATENCY_FACTOR = 3.0            # a moving average of latency above this multiple of the baseline counts as congestion
+MIN_CONGESTED_LATENCY = 0.1     # a moving average below this (seconds) never counts as congestion, however low the baseline
+LATENCY_DECREASE = 0.9          # factor applied to the rate on a congested response
+LATENCY_SMOOTHING = 0.2         # weight of the newest sample in the moving average of response latency
+BASELINE_DRIFT = 0.05           # weight with which the baseline follows a higher moving average, so a lasting shift becomes the norm
+
+
+# Token bucket shared by every caller in the process, with an additive-increase/multiplicative-decrease (AIMD) rate
+# The rate grows slowly while requests succeed quickly, halves on 429s, and all callers pause for any Retry-After period
+class RateLimiter:
+    def __init__(self, requests_per_second=MAX_REQUESTS_PER_SECOND, min_rate=MIN_RATE, max_rate=MAX_RATE, burst=BURST):
+        self.rate, self.min_rate, self.max_rate, self.burst = requests_per_second, min_rate, max_rate, burst
+        self.tokens = float(burst)
+        self.last_refill = monotonic()
+        self.blocked_until = 0.0        # no request may be sent before this time (Retry-After / back-off)
+        self.last_decrease = 0.0
+        self.latency = {}               # request kind -> moving average of response latency (seconds)
+        self.baseline_latency = {}      # request kind -> lowest moving average seen, drifting up towards the current average
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    # Reserve the next request slot; returns the number of seconds the caller must wait before sending
+    # Tokens only accrue once a Retry-After block is over, so callers queued behind it are spaced at the rate rather than released together
+    def reserve(self):
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.blocked_until)
+            self.tokens = min(self.burst, self.tokens + max(0.0, start - self.last_refill) * self.rate)
+            self.last_refill = max(self.last_refill, start)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return (start - now) + wait
+
+    # Block until the caller may send its request; returns the number of seconds spent waiting
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0: sleep(delay)
+        return delay
+
+    # Record a successful response and its latency (seconds); increases the rate unless the API looks congested
+    # Latency is tracked per kind of request (e.g. cheap aggregations vs. full data pages), and only a moving average well above
+    # its kind's baseline counts as congestion, so neither mixing request kinds nor a single slow response cuts the rate
+    def on_success(self, latency, kind='data'):
+        with self.lock:
+            average = self.latency.get(kind)
+            average = latency if average is None else (1 - LATENCY_SMOOTHING) * average + LATENCY_SMOOTHING * latency
+            baseline = self.baseline_latency.get(kind)
+            if baseline is None or average < baseline: baseline = average
+            else: baseline += BASELINE_DRIFT * (average - baseline)
+            self.latency[kind], self.baseline_latency[kind] = average, baseline
+            if average > max(LATENCY_FACTOR * baseline, MIN_CONGESTED_LATENCY):
+                self.rate = max(self.min_rate, self.rate * LATENCY_DECREASE)
+            else:
+                self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+
+    # Record a 'Too Many Requests' response; pauses every caller for retry_after seconds and cuts the rate
+    # Simultaneous 429s from concurrent requests only cut the rate once
+    def on_throttle(self, retry_after):
+        with self.lock:
+            now = monotonic()
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.tokens = min(self.tokens, 1.0)     # one request may go as soon as the block ends; the rest follow at the rate
+            self.last_refill = max(self.last_refill, self.blocked_until)
+            if now - self.last_decrease > 1 / self.rate:
+                self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+                self.last_decrease = now
+
+
+rate_limiter = RateLimiter()
+
+
+# Change the shared request-rate budget (requests per second); the limiter keeps adapting from this value
+def set_rate_limit(requests_per_second, min_rate=MIN_RATE, max_rate=MAX_RATE):
+    with rate_limiter.lock:
+        rate_limiter.rate, rate_limiter.min_rate, rate_limiter.max_rate = requests_per_second, min_rate, max(max_rate, requests_per_second)
+
+
+# Parse a Retry-After header value (delay in seconds or an HTTP date); returns seconds, or None if absent/malformed
+def parse_retry_after(value):
+    if value is None: return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
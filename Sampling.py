@@ -1,78 +1,188 @@
 from RedditAPIWrapper.Main import *
-from RedditAPIWrapper.Utilities import pretty_print, daterange
+from RedditAPIWrapper.Metrics import emit, phase, collect, Stats
+from RedditAPIWrapper.Utilities import pretty_print
 
-from datetime import date, datetime, timedelta
-from random import shuffle
+from math import ceil
+import random
 
 
-MIN_SAMPLES = 10    # minimum number of unique days sampled
+MIN_SAMPLES = 10        # minimum number of unique days sampled
+SAMPLE_WORKERS = 8      # default number of slices fetched concurrently
+SLICE_RESULTS = 250     # a day's quota is fetched from one random slice of the day per SLICE_RESULTS results
+OVERSAMPLING = 1.5      # slices hold about OVERSAMPLING times the quota; the sample is thinned at random to count
+SLICE_SLACK = 3         # a slice's page has room for SLICE_SLACK times its expected results, so busy minutes are fetched whole
+WEIGHTINGS = ('count', 'day')
 
-# Sample submissions uniformly over the given time range
-def sample_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=1000, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True):
-    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
-
-    kwargs =  {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'count': count, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'time_range': time_range, 'score_range': score_range, 'num_comments_range': num_comments_range}
 
-    kwargs['aggs'], kwargs['frequency'] = 'created_utc', 'day'
-    agg_results = fetch_data(base_url, kwargs=kwargs, printing=printing)[0]['aggs']['created_utc']
+# Sample submissions over the given time range from day and hour histograms of the search predicate
+# Days are drawn as strata and each day's quota is fetched from random slices of the day (up to `workers` at once); see plan_strata
+#   weighting='count' makes every submission about equally likely; weighting='day' gives every non-empty day an equal share
+#   strata: number of days to sample (default max(MIN_SAMPLES, count / NUM_RESULTS_PER_CALL)); more days spread the sample wider
+#   seed: seed for choosing the days and slices
+def sample_submissions(query=None, title_query=None, selftext_query=None, ids=None, count=1000, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], printing=True, weighting='count', strata=None, seed=None, workers=SAMPLE_WORKERS, stats=None):
+    base_url = 'https://api.pushshift.io/reddit/search/submission/?'
 
-    # params = build_url_params(query=query, title_query=title_query, selftext_query=selftext_query, ids=ids, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range, num_comments_range=num_comments_range)
-    # params['aggs'], params['frequency'] = 'created_utc', 'day'
-    # agg_results = fetch_data(base_url, params=params, printing=printing)['aggs']['created_utc']
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range, 'printing': printing}
 
-    start_date = date.fromtimestamp(agg_results[0]['key'])
-    end_date = date.fromtimestamp(agg_results[-1]['key'])
+    return sample(base_url, search_submissions_base, kwargs, count, time_range, weighting=weighting, strata=strata, seed=seed, workers=workers, stats=stats, name='submissions')
 
-    days = list(daterange(start_date, end_date))
-    shuffle(days)
-    pos = 0
 
-    max_res_per_sample = count // MIN_SAMPLES
-    results = []
-    while len(results) < count:
-        day = days[pos]
-        print(f'\nSampling submissions from {day.isoformat()}')
-        start_time = datetime.combine(day, datetime.min.time())
-        end_time = start_time + timedelta(days=1)
-        results += search_submissions(
-            query=query, title_query=title_query, selftext_query=selftext_query, ids=ids, count=max_res_per_sample, fields=fields, authors=authors, subreddits=subreddits, time_range=[start_time, end_time], score_range=score_range, num_comments_range=num_comments_range, printing=printing
-        )
-        pos += 1
-
-    return results[:count]
-
-# Sample comments uniformly from the given time range
-def sample_comments(query=None, ids=None, count=1000, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True):
+# Sample comments over the given time range from day and hour histograms of the search predicate
+# Days are drawn as strata and each day's quota is fetched from random slices of the day (up to `workers` at once); see plan_strata
+#   weighting='count' makes every comment about equally likely; weighting='day' gives every non-empty day an equal share
+#   strata: number of days to sample (default max(MIN_SAMPLES, count / NUM_RESULTS_PER_CALL)); more days spread the sample wider
+#   seed: seed for choosing the days and slices
+def sample_comments(query=None, ids=None, count=1000, fields=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], printing=True, weighting='count', strata=None, seed=None, workers=SAMPLE_WORKERS, stats=None):
     base_url = 'https://api.pushshift.io/reddit/search/comment/?'
 
-    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'printing': printing}
 
-    kwargs['aggs'], kwargs['frequency'] = 'created_utc', 'day'
-    agg_results = fetch_data(base_url, kwargs=kwargs, printing=printing)[0]['aggs']['created_utc']
-    # params = build_url_params(query=query, ids=ids, authors=authors, subreddits=subreddits, time_range=time_range, score_range=score_range)
-    # params['aggs'], params['frequency'] = 'created_utc', 'day'
-    # agg_results = fetch_data(base_url, params=params, printing=printing)['aggs']['created_utc']
+    return sample(base_url, search_comments_base, kwargs, count, time_range, weighting=weighting, strata=strata, seed=seed, workers=workers, stats=stats, name='comments')
 
-    start_date = date.fromtimestamp(agg_results[0]['key'])
-    end_date = date.fromtimestamp(agg_results[-1]['key'])
 
-    days = list(daterange(start_date, end_date))
-    shuffle(days)
-    pos = 0
+# Shared body of sample_submissions / sample_comments
+# A day histogram plans the strata and hour histograms of the sampled days place their slices; the slices are then fetched concurrently
+# and the results thinned at random to count
+def sample(base_url, search_base, kwargs, count, time_range, weighting='count', strata=None, seed=None, workers=SAMPLE_WORKERS, stats=None, name='results'):
+    printing = kwargs['printing']
+    predicate = {k: v for k, v in kwargs.items() if k not in ('fields', 'printing')}
+    a, b = time_range_to_interval(time_range)
+    rng = random.Random(seed)
 
-    max_res_per_sample = count // MIN_SAMPLES
+    if stats is None: stats = Stats()
     results = []
-    while len(results) < count:
-        day = days[pos]
-        print(f'\nSampling comments from {day.isoformat()}')
-        start_time = datetime.combine(day, datetime.min.time())
-        end_time = start_time + timedelta(days=1)
-        results += search_comments(
-            query=query, ids=ids, count=max_res_per_sample, fields=fields, authors=authors, subreddits=subreddits, time_range=[start_time, end_time], score_range=score_range, printing=printing
-        )
-        pos += 1
-
-    return results[:count]
+    with collect(stats):
+        if a < b:
+            buckets = []
+            with phase('sample'):
+                for start, end in histogram_spans(a, b, 'day'):
+                    buckets += fetch_histogram(base_url, predicate, 'day', start, end, printing=printing)
+            days, target = plan_strata(buckets, count, weighting=weighting, strata=strata, rng=rng)
+            hours = []
+            with phase('sample'):
+                for start, end in hour_spans(days):
+                    hours += fetch_histogram(base_url, predicate, 'hour', start, end, printing=printing)
+            windows = plan_slices(days, hours, rng=rng)
+            if printing: print(f'\nSampling {target} {name} from {len(windows)} slices of {len(days)} of {len(buckets)} days...')
+            for page in fetch_windows(search_base, kwargs, windows, sum(n for _, n in windows), workers=workers, name=name):
+                emit('page', records=len(page))
+                results.extend(page)
+            results = thin(results, target, rng=rng)
+    if printing: print(f'\n{stats.report()}')
+    return results
+
+
+# Choose the days to sample from a day histogram (a list of (start, end, doc_count) buckets) and give each a quota
+# Returns the chronological list of sampled (start, end, doc_count, quota) days and the target sample size, min(count, number of
+# results reachable with one page per day); see plan_slices for how each day's quota is fetched
+# If there are more days than strata, days are drawn without replacement (in proportion to their counts for weighting='count',
+# uniformly for weighting='day') and given equal quotas; otherwise every day is used and quotas follow the weighting
+# Days are added beyond strata until their pages can hold count results
+def plan_strata(buckets, count, weighting='count', strata=None, rng=random):
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f'weighting must be one of {WEIGHTINGS}, not {weighting!r}')
+    if strata is None: strata = max(MIN_SAMPLES, ceil(count / NUM_RESULTS_PER_CALL))
+
+    capacities = [min(num_results, NUM_RESULTS_PER_CALL) for _, _, num_results in buckets]
+    target = min(count, sum(capacities))
+
+    if len(buckets) <= strata:
+        chosen = list(range(len(buckets)))
+        weights = [buckets[i][2] if weighting == 'count' else 1 for i in chosen]
+    else:
+        # weighted sampling without replacement: sort by random keys u^(1/w) (Efraimidis-Spirakis)
+        if weighting == 'count': keys = [rng.random() ** (1 / num_results) for _, _, num_results in buckets]
+        else: keys = [rng.random() for _ in buckets]
+        chosen, room = [], 0
+        for i in sorted(range(len(buckets)), key=keys.__getitem__, reverse=True):
+            if len(chosen) >= strata and room >= target: break
+            chosen.append(i)
+            room += capacities[i]
+        chosen.sort()
+        weights = [1] * len(chosen)     # the draw already favours dense days
+
+    quotas = allocate_quotas([capacities[i] for i in chosen], weights, target)
+    return [(*buckets[i], quota) for i, quota in zip(chosen, quotas) if quota > 0], target
+
+
+# Group the sampled days into the spans of the hour histograms needed to place their slices (at most MAX_HISTOGRAM_BUCKETS hours each)
+def hour_spans(days):
+    spans = []
+    for start, end, _, _ in days:
+        if spans and end - spans[-1][0] <= (MAX_HISTOGRAM_BUCKETS - 1) * FREQUENCY_SECONDS['hour']:
+            spans[-1][1] = end
+        else:
+            spans.append([start, end])
+    return [(start, end) for start, end in spans]
+
+
+# Cover the quotas of the sampled days with random slices, placed using an hour histogram (chronological (start, end, doc_count)
+# buckets) covering the days
+# A page holds the newest results of its window, so sampling a whole day with one page would only return its last hours. Instead slices
+# holding about OVERSAMPLING times the quota are fetched whole (one slice per SLICE_RESULTS of quota), so that every result of the day
+# is about equally likely to be fetched. The slices are evenly spaced over the day's results (ranked by time) from a random offset, and
+# the last one wraps around to the day's start, so they never overlap
+# Returns a chronological list of (time_range, size) windows, each with room for SLICE_SLACK times the results expected in it
+def plan_slices(days, hours, rng=random):
+    windows = []
+    for start, end, _, quota in days:
+        buckets = [(max(lo, start), min(hi, end), num_results) for lo, hi, num_results in hours if lo < end and hi > start]
+        total = sum(num_results for _, _, num_results in buckets)
+        if total == 0: continue
+        num_slices = ceil(quota / SLICE_RESULTS)
+        segment = total / num_slices
+        width = min(segment, OVERSAMPLING * quota / num_slices)
+        offset = rng.random() * segment
+
+        ranks = []
+        for k in range(num_slices):
+            lo, hi = k * segment + offset, k * segment + offset + width
+            if hi > total:      # wrap around; the wrapped part ends before the first slice's start
+                ranks.append((0, hi - total))
+                hi = total
+            ranks.append((lo, hi))
+        for lo, hi in sorted(ranks):
+            a, b = rank_to_time(buckets, lo), rank_to_time(buckets, hi)
+            if a < b: windows.append((interval_to_time_range(a, b), min(NUM_RESULTS_PER_CALL, ceil(SLICE_SLACK * (hi - lo)))))
+    return windows
+
+
+# Return the second before which about `rank` results of the histogram buckets fall (results are assumed evenly spread within a bucket)
+def rank_to_time(buckets, rank):
+    for start, end, num_results in buckets:
+        if rank < num_results: return start + int(rank / num_results * (end - start))
+        rank -= num_results
+    return buckets[-1][1]
+
+
+# Keep target of the results at random (in their original order); thinning every result with the same probability keeps them equally likely
+def thin(results, target, rng=random):
+    if len(results) <= target: return results
+    keep = set(rng.sample(range(len(results)), target))
+    return [item for i, item in enumerate(results) if i in keep]
+
+
+# Split total into integer quotas in proportion to weights (largest remainder method), capping each quota at its capacity
+# The share of a capped stratum is redistributed among the others; assumes total <= sum(capacities)
+def allocate_quotas(capacities, weights, total):
+    quotas = [0] * len(capacities)
+    remaining = total
+    available = [i for i, capacity in enumerate(capacities) if capacity > 0]
+    while remaining > 0 and available:
+        weight = sum(weights[i] for i in available)
+        shares = {i: remaining * weights[i] / weight for i in available}
+        grants = {i: min(int(shares[i]), capacities[i] - quotas[i]) for i in available}
+        leftover = remaining - sum(grants.values())
+        for i in sorted(available, key=lambda i: shares[i] - int(shares[i]), reverse=True):
+            if leftover <= 0: break
+            if grants[i] < capacities[i] - quotas[i]:
+                grants[i] += 1
+                leftover -= 1
+        for i in available:
+            quotas[i] += grants[i]
+        remaining -= sum(grants.values())
+        available = [i for i in available if quotas[i] < capacities[i]]
+    return quotas
 
 
 if __name__ == '__main__':
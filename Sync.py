@@ -0,0 +1,139 @@
+# --- Incremental sync of a local store with new search results, using high-water marks and id dedupe --- #
+from array import array
+from datetime import datetime, timedelta
+from time import sleep
+import os
+
+from RedditAPIWrapper.Export import ShardWriter, read_manifest, write_manifest, describe_query, remove_uncheckpointed_shards, SHARD_MAX_BYTES
+from RedditAPIWrapper.Main import iter_submissions, iter_comments, NUM_RESULTS_LIMIT
+
+
+SYNC_OVERLAP = timedelta(hours=1)       # re-fetch this far behind the high-water mark to catch items indexed late
+POLL_INTERVAL = timedelta(minutes=5)    # default time between syncs in tail mode
+KEY_FIELDS = ['id', 'created_utc']      # fields needed to deduplicate records and advance the high-water mark
+
+
+# Read the on-disk id index: an array of (created_utc, id) pairs with base-36 ids stored as integers
+# Returns a dictionary id -> created_utc
+def read_ids(path):
+    pairs = array('q')
+    if path is not None and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            pairs.frombytes(f.read())
+    return dict(zip(pairs[1::2], pairs[0::2]))
+
+
+# Write the ids created at or after cutoff to a new id index file
+def write_ids(path, ids, cutoff):
+    pairs = array('q')
+    for key, created in ids.items():
+        if created >= cutoff: pairs.extend((created, key))
+    with open(path + '.tmp', 'wb') as f:
+        pairs.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+# Append the results of `iterate` (iter_submissions or iter_comments) created since the store's high-water mark to the store under
+# directory; yields each new record once it has been written
+# Every sync re-fetches `overlap` behind the high-water mark and skips records whose ids are already stored. Only ids created within
+# the overlap can be fetched again, so the id index keeps just those. The store is written with Export's shard writer and manifest,
+# so read_export reads it back and an interrupted sync loses nothing but its own unfinished work
+#   since: start of the first sync (later syncs continue from the high-water mark)
+def sync_records(directory, iterate, kwargs, prefix, since=None, overlap=SYNC_OVERLAP, shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    os.makedirs(directory, exist_ok=True)
+    description = describe_query(kwargs)
+    manifest = read_manifest(directory)
+    if manifest is None:
+        if since is None: since = datetime(2005, 12, 1)     # approximate start date of data set
+        manifest = {'query': description, 'prefix': prefix, 'high_water': int(since.timestamp()) - 1, 'shard': [0, 0], 'records': 0, 'ids': None, 'syncs': 0}
+    elif manifest['query'] != description:
+        raise ValueError(f'{directory} holds a sync of a different query: {manifest["query"]}')
+
+    if kwargs.get('fields'): kwargs = {**kwargs, 'fields': sorted(set(kwargs['fields'] + KEY_FIELDS))}
+    overlap_seconds = int(overlap.total_seconds())
+
+    index, size = manifest['shard']
+    remove_uncheckpointed_shards(directory, prefix, index)
+    ids_path = os.path.join(directory, manifest['ids']) if manifest['ids'] else None
+    seen = read_ids(ids_path)
+
+    writer = ShardWriter(directory, prefix, max_bytes=shard_max_bytes, index=index, size=size)
+    try:
+        start = manifest['high_water'] - (overlap_seconds if manifest['syncs'] else 0)    # the first sync starts exactly at since
+        while True:
+            high_water, cursor = manifest['high_water'], start
+            time_range = [datetime.fromtimestamp(start), datetime.today()]
+            if printing: print(f'\nSyncing {prefix} since {time_range[0].isoformat()} ...')
+            num_fetched, num_new = 0, 0
+            # ascending order: a search cut off at the result limit has fetched everything up to its newest record (the cursor)
+            for record in iterate(**kwargs, count=None, time_range=time_range, sort_rev=False, printing=printing, workers=workers):
+                num_fetched += 1
+                cursor = max(cursor, record['created_utc'])
+                key = int(record['id'], 36)
+                if key in seen: continue
+                seen[key] = record['created_utc']
+                high_water = max(high_water, record['created_utc'])
+                writer.write(record)
+                num_new += 1
+                yield record
+
+            # the new id index gets a fresh name, so a crash before the manifest is written leaves the old one in use
+            cutoff = high_water - overlap_seconds
+            filename = f'{prefix}-ids-{manifest["syncs"] + 1:05d}.bin'
+            write_ids(os.path.join(directory, filename), seen, cutoff)
+            manifest['shard'] = list(writer.checkpoint())
+            manifest['records'] += num_new
+            manifest['high_water'], manifest['ids'], manifest['syncs'] = high_water, filename, manifest['syncs'] + 1
+            write_manifest(directory, manifest)
+            if ids_path is not None and os.path.isfile(ids_path): os.remove(ids_path)
+            ids_path = os.path.join(directory, filename)
+            seen = {key: created for key, created in seen.items() if created >= cutoff}
+
+            if printing: print(f'\nSynced {num_new} new {prefix} ({num_fetched - num_new} already stored); high-water mark {datetime.fromtimestamp(high_water).isoformat()}.')
+            # a search stopped by the result limit continues from the cursor's second (partly fetched), without another overlap
+            if num_fetched < NUM_RESULTS_LIMIT or cursor - 1 <= start: break
+            start = cursor - 1
+    finally:
+        writer.close()
+
+
+# Follow the results of `iterate` continuously: sync every interval and yield the new records
+#   polls: number of syncs before stopping (None to follow forever)
+def tail(directory, iterate, kwargs, prefix, since=None, overlap=SYNC_OVERLAP, interval=POLL_INTERVAL, polls=None, shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    num_polls = 0
+    while polls is None or num_polls < polls:
+        yield from sync_records(directory, iterate, kwargs, prefix, since=since, overlap=overlap, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing)
+        num_polls += 1
+        if polls is None or num_polls < polls: sleep(interval.total_seconds())
+
+
+# Append every submission satisfying the search predicate created since the last sync to the store under directory
+# Returns the store's manifest; read the stored submissions with read_export (see Export.py)
+def sync_submissions(directory, query=None, title_query=None, selftext_query=None, ids=None, fields=None, authors=None, subreddits=None, score_range=[None, None], num_comments_range=[None, None], since=None, overlap=SYNC_OVERLAP, shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    for _ in sync_records(directory, iter_submissions, kwargs, 'submissions', since=since, overlap=overlap, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing): pass
+    return read_manifest(directory)
+
+
+# Append every comment satisfying the search predicate created since the last sync to the store under directory
+# Returns the store's manifest; read the stored comments with read_export (see Export.py)
+def sync_comments(directory, query=None, ids=None, fields=None, authors=None, subreddits=None, score_range=[None, None], since=None, overlap=SYNC_OVERLAP, shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+    for _ in sync_records(directory, iter_comments, kwargs, 'comments', since=since, overlap=overlap, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing): pass
+    return read_manifest(directory)
+
+
+# Generator following new submissions satisfying the search predicate; syncs the store under directory every interval
+# and yields the submissions it added
+def tail_submissions(directory, query=None, title_query=None, selftext_query=None, ids=None, fields=None, authors=None, subreddits=None, score_range=[None, None], num_comments_range=[None, None], since=None, overlap=SYNC_OVERLAP, interval=POLL_INTERVAL, polls=None, shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    kwargs = {'query': query, 'title_query': title_query, 'selftext_query': selftext_query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range, 'num_comments_range': num_comments_range}
+    return tail(directory, iter_submissions, kwargs, 'submissions', since=since, overlap=overlap, interval=interval, polls=polls, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing)
+
+
+# Generator following new comments satisfying the search predicate; syncs the store under directory every interval
+# and yields the comments it added
+def tail_comments(directory, query=None, ids=None, fields=None, authors=None, subreddits=None, score_range=[None, None], since=None, overlap=SYNC_OVERLAP, interval=POLL_INTERVAL, polls=None, shard_max_bytes=SHARD_MAX_BYTES, workers=1, printing=True):
+    kwargs = {'query': query, 'ids': ids, 'fields': fields, 'authors': authors, 'subreddits': subreddits, 'score_range': score_range}
+    return tail(directory, iter_comments, kwargs, 'comments', since=since, overlap=overlap, interval=interval, polls=polls, shard_max_bytes=shard_max_bytes, workers=workers, printing=printing)
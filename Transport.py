@@ -0,0 +1,94 @@
+# --- Pluggable HTTP transports used by fetch_data --- #
+from datetime import timedelta
+from http.client import responses
+from time import monotonic
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+API_HOST = 'https://api.pushshift.io'
+POOL_SIZE = 16                  # max number of keep-alive connections held open to the API
+CONNECT_TIMEOUT_SECONDS = 10
+READ_TIMEOUT_SECONDS = 60
+
+
+# Default transport; a single pooled keep-alive session with gzip negotiation shared by every request in the process
+#   host: redirect requests for API_HOST to another server (e.g. a local stub such as 'http://localhost:8000')
+class HTTPTransport:
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT_SECONDS, read_timeout=READ_TIMEOUT_SECONDS, host=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.timeout = (connect_timeout, read_timeout)
+        self.host = host
+
+    def get(self, url):
+        if self.host and url.startswith(API_HOST):
+            url = self.host + url[len(API_HOST):]
+        return self.session.get(url, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+# Minimal stand-in for requests.Response, as returned by FakeTransport
+class FakeResponse:
+    def __init__(self, status_code, contents, headers=None, elapsed=0.0):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = responses.get(status_code, '')
+        self.headers = headers or {}
+        self.content = contents if isinstance(contents, bytes) else json.dumps(contents).encode()
+        self.elapsed = timedelta(seconds=elapsed)
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# In-process transport for testing and benchmarking without network access
+#   handler: function taking the full request url and returning (status_code, contents) or (status_code, contents, headers),
+#            where contents is a json-serializable object or raw bytes
+# Every requested url is recorded in self.urls
+class FakeTransport:
+    def __init__(self, handler):
+        self.handler = handler
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            self.urls.append(url)
+        start = monotonic()
+        status_code, contents, *headers = self.handler(url)
+        return FakeResponse(status_code, contents, headers=headers[0] if headers else None, elapsed=monotonic() - start)
+
+    def close(self):
+        pass
+
+
+transport = None
+transport_lock = threading.Lock()
+
+
+# Return the transport used by fetch_data (created on first use)
+def get_transport():
+    global transport
+    if transport is None:
+        with transport_lock:
+            if transport is None:
+                transport = HTTPTransport()
+    return transport
+
+
+# Replace the transport used by fetch_data (e.g. with an HTTPTransport of a different pool size, or a FakeTransport)
+def set_transport(new_transport):
+    global transport
+    with transport_lock:
+        if transport is not None and transport is not new_transport:
+            transport.close()
+        transport = new_transport
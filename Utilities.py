@@ -1,69 +1,206 @@
 # --- Utility functions for the PushshiftWrapper and assosciated scripts --- #
-import requests
-from time import sleep
-import urllib
+from collections import deque
+import concurrent.futures
+import contextvars
+import urllib.parse
 import json
 import os
 from datetime import date, datetime, timedelta
 
+from RedditAPIWrapper.Cache import get_cache
+from RedditAPIWrapper.Decode import decode_response, prune
+from RedditAPIWrapper.Metrics import emit
+from RedditAPIWrapper.RateLimit import rate_limiter, parse_retry_after
+from RedditAPIWrapper.Transport import get_transport
+
 
 # class URLTooLongError(Exception):
 #     pass
 
 
-# Wrapper for requests.get; handles 'Too Many Requests' errors; returns response.json()
-# returns a list of response.json's stratified by the longest param
+# Wrapper for the HTTP transport's get (see Transport.py); handles 'Too Many Requests' errors; returns the decoded response
+# responses are parsed with orjson when installed and pruned to the requested fields (see Decode.py)
+# every request goes through the process-wide adaptive rate limiter (see RateLimit.py)
+# returns a list of decoded responses; a url longer than MAX_URL_LENGTH is packed into several requests fetched concurrently (see pack_chunks)
+# responses are served from / stored in the on-disk cache when it is enabled (see Cache.py)
+# every request, wait and failure is reported as an event (see Metrics.py)
 ATTEMPT_LIMIT = 5
 BASE_SLEEP_DURATION_SECONDS = 0.35  # seems to be lower limit
 MAX_URL_LENGTH = 6000
+STRATIFY_WORKERS = 8    # number of chunks of a packed request fetched at once
 def fetch_data(url, kwargs={}, printing=True, attempt=0):
     if attempt > ATTEMPT_LIMIT:
         print('\nAttempt limit exceeded.')
         return None
     
     params = build_url_params(**kwargs)
-
-    # encode url params while still allowing commas; this is unconventional but that's pushshift for ya :/
-    encoded_params = [f'{k}={urllib.parse.quote(str(v), safe=",")}' for k, v in params.items()]
-    combined_url = url + '&'.join(encoded_params)
+    combined_url = build_url(url, params)
 
     if len(combined_url) > MAX_URL_LENGTH:
-        # stratify by longest list param
-        longest_param = max(('ids', 'authors', 'subreddits'), key=lambda k: len(kwargs[k]) if kwargs[k] else 0)
-        if printing: print(f'URL too long; stratifying request by longest list param: {longest_param} ...')
-        n = len(kwargs[longest_param]) // 2
-        left_val = kwargs[longest_param][:n]
-        right_val = kwargs[longest_param][n:]
-        return fetch_data(url, kwargs={**kwargs, **{longest_param: left_val}}, printing=printing) +\
-               fetch_data(url, kwargs={**kwargs, **{longest_param: right_val}}, printing=printing)
+        chunks = pack_chunks(url, kwargs)
+        if len(chunks) > 1:
+            if printing: print(f'URL too long; packed list params into {len(chunks)} requests ...')
+            results = list(map_ordered(lambda chunk: fetch_data(url, kwargs=chunk, printing=printing), chunks, workers=STRATIFY_WORKERS))
+            if any(res is None for res in results): return None
+            return [contents for res in results for contents in res]
+
+    cache = get_cache()
+    if cache is not None:
+        contents = cache.get(url, params)
+        if contents is not None:
+            if printing: print(f'\nServed \'{combined_url}\' from cache.')
+            emit('request', url=combined_url, cached=True)
+            return [prune(contents, kwargs.get('fields'))]
 
     if printing: print(f'\nFetching data from \'{combined_url}\' ...')
 
+    waited = rate_limiter.acquire()
+    if waited > 0: emit('rate_wait', seconds=waited)
     try:
-        response = requests.get(combined_url)
+        response = get_transport().get(combined_url)
     except Exception as e:
         print(f'Request failed critically; Error: {e}')
+        emit('error', url=combined_url, error=str(e))
         return None
     
     if printing: print(f'Done. Status code: {response.status_code} ({response.reason}). Elapsed time: {round(response.elapsed.total_seconds(), 2)} seconds.')
+    emit('request', url=combined_url, status=response.status_code, latency=response.elapsed.total_seconds(), bytes=len(response.content), attempt=attempt)
 
     if response.ok:
-        contents = response.json()
+        rate_limiter.on_success(response.elapsed.total_seconds(), kind=request_kind(params))
+        contents = decode_response(response.content, kwargs.get('fields'))
+        if cache is not None: cache.put(url, params, response.content)
         return [contents]
     else:
         if response.status_code == 429:
-            sleep_duration = BASE_SLEEP_DURATION_SECONDS * 2**attempt   # exponentially increase wait time with successive attempts
+            sleep_duration = retry_delay(response.headers, attempt)
             if printing: print(f'Request failed; waiting {sleep_duration} seconds before trying again...')
-            sleep(sleep_duration)
-            return fetch_data(url, printing=printing, attempt=attempt+1)
+            rate_limiter.on_throttle(sleep_duration)    # the limiter holds back every caller, not just this one
+            emit('throttle', seconds=sleep_duration, attempt=attempt)
+            return fetch_data(url, kwargs=kwargs, printing=printing, attempt=attempt+1)
         else:
             print('Request failed critically.')
+            emit('error', url=combined_url, error=f'status code {response.status_code}')
             return None
 
 
+# Return the number of seconds to wait before retrying a 'Too Many Requests' response with the given headers
+def retry_delay(headers, attempt):
+    delay = parse_retry_after(headers.get('Retry-After'))
+    if delay is None:
+        delay = BASE_SLEEP_DURATION_SECONDS * 2**attempt   # exponentially increase wait time with successive attempts
+    return delay
+
+
+# Return the kind of request given by its url params, for the rate limiter's latency tracking: record-less aggregation / metadata
+# requests (size=0) answer much faster than pages of records
+def request_kind(params):
+    return 'aggregation' if params.get('size') == 0 else 'data'
+
+
+# Combine an endpoint url and a dictionary of url parameters
+def build_url(url, params):
+    # encode url params while still allowing commas; this is unconventional but that's pushshift for ya :/
+    encoded_params = [f'{k}={urllib.parse.quote(str(v), safe=",")}' for k, v in params.items()]
+    return url + '&'.join(encoded_params)
+
+
+# Url params of the list arguments which may be split across several requests
+LIST_PARAMS = {'ids': 'ids', 'authors': 'author', 'subreddits': 'subreddit'}
+
+
+# Return the number of url characters a list param value takes (including its separating comma)
+def encoded_length(value):
+    return len(urllib.parse.quote(str(value), safe=',')) + 1
+
+
+# Split a request whose url is longer than limit into requests whose urls fit, packing list params into as few chunks as possible
+# The longest list param is packed into whatever room the rest of the url leaves; if the rest of the url is itself longer than
+# half the limit, the other list params are packed into half the limit first and every combination of chunks is requested
+# (each result matches exactly one combination). Returns a list of kwargs (just [kwargs] if it fits or cannot be split)
+def pack_request(url, kwargs, limit=MAX_URL_LENGTH):
+    if len(build_url(url, build_url_params(**kwargs))) <= limit: return [kwargs]
+    lists = [k for k in LIST_PARAMS if kwargs.get(k)]
+    if not lists: return [kwargs]
+
+    longest = max(lists, key=lambda k: sum(encoded_length(v) for v in kwargs[k]))
+    rest = {**kwargs, longest: None}
+    rest_length = len(build_url(url, build_url_params(**rest)))
+    if rest_length > limit // 2 and len(lists) > 1:
+        return [chunk for part in pack_request(url, rest, limit=limit // 2) for chunk in pack_request(url, {**part, longest: kwargs[longest]}, limit=limit)]
+
+    capacity = limit - rest_length - len(f'&{LIST_PARAMS[longest]}=') + 1     # the last value needs no comma
+    return [{**kwargs, longest: chunk} for chunk in pack_values(kwargs[longest], capacity)]
+
+
+# Split an over-long request into url-length-safe requests (see pack_request), to be fetched separately and merged with merge_data
+# If only some fields are requested, the sort field is requested too so that merge_data can put the records in order
+def pack_chunks(url, kwargs):
+    key = kwargs.get('sort_attribute') or 'created_utc'
+    if kwargs.get('fields') and key not in kwargs['fields']: kwargs = {**kwargs, 'fields': list(kwargs['fields']) + [key]}
+    return pack_request(url, kwargs)
+
+
+# Pack distinct values (in order) into chunks whose encoded lengths sum to at most capacity, each holding at most max_values values
+# Values are tiny next to the capacity, so filling each chunk before starting the next wastes less than one value per chunk
+# (at most one chunk more than the optimum); a value longer than the capacity gets a chunk of its own
+def pack_values(values, capacity, max_values=None):
+    chunks, chunk, size = [], [], 0
+    for value in dict.fromkeys(values):
+        n = encoded_length(value)
+        if chunk and (size + n > capacity or (max_values is not None and len(chunk) >= max_values)):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(value)
+        size += n
+    if chunk: chunks.append(chunk)
+    return chunks
+
+
+# Apply function to every item on a pool of worker threads; yields the results in order
+# At most `workers` items are in flight at once, and each call runs in a copy of the caller's context (see Metrics.py)
+def map_ordered(function, items, workers=STRATIFY_WORKERS):
+    items = iter(items)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < workers:
+                item = next(items, None)
+                if item is None: break
+                pending.append(executor.submit(contextvars.copy_context().run, function, item))
+            if not pending: return
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Merge the records of several responses to one search (e.g. of a packed request) into a single page, dropping repeated ids
+# Every response holds up to count records of its own, so the records are put in the search's order (by sort_attribute, default
+# created_utc; descending like the API unless sort_rev is False) and cut to count. A sort field added by pack_chunks is dropped
+#   fields: the fields the caller requested (None for all)
+def merge_data(results, sort_attribute=None, sort_rev=None, count=None, fields=None):
+    seen = set()
+    records = []
+    for res in results:
+        for record in res['data']:
+            key = record.get('id')
+            if key is not None:
+                if key in seen: continue
+                seen.add(key)
+            records.append(record)
+
+    key = sort_attribute or 'created_utc'
+    if all(record.get(key) is not None for record in records):
+        records.sort(key=lambda record: record[key], reverse=sort_rev is not False)
+    if count is not None: records = records[:count]
+    if fields and key not in fields: records = [{k: v for k, v in record.items() if k != key} for record in records]
+    return records
+
+
 # Given a set of arguments to the '/reddit/search/comment' endpoint, return a dictionary of url parameters
 # For API documentation, see https://github.com/pushshift/api
-def build_url_params(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], aggs=None, frequency=None):
+def build_url_params(query=None, title_query=None, selftext_query=None, ids=None, count=None, fields=None, sort_attribute=None, sort_rev=None, authors=None, subreddits=None, time_range=[None, None], score_range=[None, None], num_comments_range=[None, None], size=None, metadata=None, aggs=None, frequency=None):
     params = {}
     
     if query: params['q'] = query
@@ -74,6 +211,7 @@ def build_url_params(query=None, title_query=None, selftext_query=None, ids=None
     if fields: params['fields'] = ','.join(fields)
     if sort_attribute: params['sort_type'] = sort_attribute
     if sort_rev: params['sort'] = 'desc'
+    elif sort_rev is False: params['sort'] = 'asc'     # None leaves the API's default order (descending)
     if authors: params['author'] = ','.join(authors)
     if subreddits: params['subreddit'] = ','.join(subreddits)
 
@@ -90,10 +228,12 @@ def build_url_params(query=None, title_query=None, selftext_query=None, ids=None
     if num_comments_range[1]: num_comments_params.append(f'<{num_comments_range[1] + 1}')
     params['num_comments'] = ','.join(num_comments_params)
 
+    if size is not None: params['size'] = size     # explicit page size (e.g. 0 for metadata/aggregation-only requests)
+    if metadata: params['metadata'] = 'true'
     if aggs: params['aggs'] = aggs
     if frequency: params['frequency'] = frequency
 
-    return {k: v for k, v in params.items() if v}
+    return {k: v for k, v in params.items() if v or v == 0}
 
 
 # Print a json object in an easily readable abbreviated form